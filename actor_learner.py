@@ -0,0 +1,26 @@
+from batch_episode import BatchEpisode
+from racetrack import Racetrack
+from state_values import StateValues
+
+import numpy as np
+
+# Actor processes of RLRacetrack.run_parallel: each one keeps the racetrack and the policy settings,
+# and receives a snapshot of the state values with every request for episodes
+_racetrack = None
+_settings = None
+
+
+def init_actor(racetrack: Racetrack, settings: dict):
+    global _racetrack, _settings
+    _racetrack = racetrack
+    _settings = settings
+
+
+def generate_episodes(values: np.ndarray, counts: np.ndarray, rng: np.random.Generator, n_episodes):
+    # Simulate n_episodes with the snapshot of the state values. The generator is sent back so that
+    # the learner keeps the random stream of every actor
+    state_values = StateValues(_racetrack, 0)
+    state_values.assign(values, counts)
+    batch = BatchEpisode(_racetrack, state_values=state_values, rng=rng, **_settings)
+    paths, reached_end = batch.simulate(n_episodes)
+    return paths, reached_end, rng
@@ -0,0 +1,105 @@
+from episode import ACTIONS
+from racetrack import Racetrack, CRASH, FINISHED, OK
+from state_values import StateValues
+
+import numpy as np
+
+
+class BatchEpisode:
+    def __init__(self, racetrack: Racetrack, epsilon, state_values: StateValues, min_speed_x, max_speed_x, min_speed_y,
+                 max_speed_y, delta, max_episode_length, rng: np.random.Generator):
+        # Simulates several episodes in lockstep, with the same policy as Episode: no-op with probability delta,
+        # otherwise epsilon-greedy on the state values (ties broken by count, then at random)
+        self.racetrack = racetrack
+        self.epsilon = epsilon
+        self.state_values = state_values
+        self.min_speed_x = min_speed_x
+        self.max_speed_x = max_speed_x
+        self.min_speed_y = min_speed_y
+        self.max_speed_y = max_speed_y
+        self.delta = delta
+        self.max_episode_length = max_episode_length
+        self.rng = rng
+
+        self._actions = np.array(ACTIONS)
+        self._no_op = ACTIONS.index((0, 0))
+        self._start_positions = np.array([(x, y) for y, x in racetrack.start_positions])
+
+    def go_to_start(self, n):
+        # Random start positions with a random vertical velocity, as in Episode.simulate
+        positions = self._start_positions[self.rng.integers(len(self._start_positions), size=n)]
+        velocities = np.zeros((n, 2), dtype=np.int64)
+        velocities[:, 1] = self.rng.integers(self.min_speed_y, self.max_speed_y + 1, size=n)
+        return positions, velocities
+
+    def choose_actions(self, positions, velocities):
+        # Vectorized action choice of Episode.simulate, returns action indices
+        n = len(positions)
+        new_velocities = velocities[:, None, :] + self._actions[None, :, :]
+        vx, vy = new_velocities[..., 0], new_velocities[..., 1]
+        possible = (vx >= self.min_speed_x) & (vx <= self.max_speed_x) & \
+                   (vy >= self.min_speed_y) & (vy <= self.max_speed_y) & ((vx != 0) | (vy != 0))
+
+        # Random keys among the candidates implement both the random choice and the random tie-breaking
+        keys = self.rng.random((n, len(ACTIONS)))
+        no_op = self.rng.random(n) < self.delta
+        explore = self.rng.random(n) < self.epsilon
+
+        # Cached greedy actions (see StateValues.greedy), the ties are compared again
+        greedy = self.state_values.greedy[self.racetrack.state_indices(positions[:, 0], positions[:, 1],
+                                                                       velocities[:, 0], velocities[:, 1])]
+        best = np.arange(len(ACTIONS)) == greedy[:, None]
+        tied = np.flatnonzero(greedy < 0)
+        if len(tied):
+            states = self.racetrack.state_indices(positions[tied, 0, None], positions[tied, 1, None],
+                                                  vx[tied], vy[tied])
+            states = np.where(possible[tied], states, 0)
+            values = np.where(possible[tied], self.state_values.values[states], -np.inf)
+            counts = np.where(possible[tied], self.state_values.counts[states], -1)
+            tied_best = values == values.max(axis=1, keepdims=True)
+            counts = np.where(tied_best, counts, -1)
+            best[tied] = tied_best & (counts == counts.max(axis=1, keepdims=True))
+
+        candidates = np.where(explore[:, None], possible, best)
+        actions = np.where(candidates, keys, -1).argmax(axis=1)
+        return np.where(no_op, self._no_op, actions)
+
+    def simulate(self, n_episodes):
+        # Returns the paths as int arrays of rows (x, y, vx, vy, action index), see episode.path_to_array,
+        # and whether each episode reached the finish line before max_episode_length
+        positions, velocities = self.go_to_start(n_episodes)
+        outcomes = np.full(n_episodes, OK, dtype=np.uint8)
+        durations = np.zeros(n_episodes, dtype=np.int64)
+        active = np.ones(n_episodes, dtype=bool)
+
+        no_action = np.full(n_episodes, -1)
+        records = [np.column_stack((positions, velocities, no_action))]
+        valid = [active.copy()]
+
+        while active.any():
+            crashed = active & (outcomes == CRASH)
+            if crashed.any():
+                positions[crashed], velocities[crashed] = self.go_to_start(int(crashed.sum()))
+                records.append(np.column_stack((positions, velocities, no_action)))
+                valid.append(crashed)
+
+            idx = np.flatnonzero(active)
+            actions = self.choose_actions(positions[idx], velocities[idx])
+            new_velocities = velocities[idx] + self._actions[actions]
+            states = self.racetrack.state_indices(positions[idx, 0], positions[idx, 1],
+                                                  new_velocities[:, 0], new_velocities[:, 1])
+            outcomes[idx] = self.racetrack.transitions[states]
+            velocities[idx] = new_velocities
+            positions[idx] += new_velocities
+            durations[idx] += 1
+
+            all_actions = no_action.copy()
+            all_actions[idx] = actions
+            records.append(np.column_stack((positions, velocities, all_actions)))
+            valid.append(active.copy())
+            active &= (outcomes != FINISHED) & (durations < self.max_episode_length)
+
+        records = np.stack(records, axis=1).astype(np.int32)
+        valid = np.stack(valid, axis=1)
+        paths = [records[i][valid[i]] for i in range(n_episodes)]
+        return paths, durations < self.max_episode_length
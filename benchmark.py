@@ -0,0 +1,209 @@
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # View imports pygame, no display is needed to parse logs
+
+from episode import Episode
+from episode_log import log_filename, open_episode_log
+from racetrack import Racetrack
+from rl_racetrack import RLRacetrack
+from utils import timestamp
+from view import View
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Throughput of the hot paths of the simulator (Episode, Racetrack), the learner (RLRacetrack) and the viewer (View),
+# for every grid size and speed limit. Metrics ending in '_per_sec' are better higher, the others are seconds.
+# Every measurement repeats a call for min_time seconds and keeps the fastest, the least disturbed by the machine
+GRID_SIZES = [30, 60, 120]
+SPEED_LIMITS = [3, 5]
+UPDATE_RULES = ['first_visit', 'every_visit', 'last_visit', 'last_visit_best']
+
+BASE_CONFIG = {
+    'seed': 3,
+    'episodes': 100,
+    'epsilon': 0.1,
+    'delta': 0.1,
+    'timestep_reward': -1,
+    'update_state_values_rule': 'last_visit',
+    'max_episode_length': 500,
+    'min_speed_x': 0,
+    'max_speed_y': 0,
+}
+
+
+def case_config(size, speed):
+    return dict(BASE_CONFIG, grid_shape=[size, size], max_speed_x=speed, min_speed_y=-speed)
+
+
+def case_name(size, speed):
+    return f'grid_{size}_speed_{speed}'
+
+
+def best_time(fn, min_time):
+    # Seconds of the fastest call of fn, called until min_time seconds have passed
+    best = np.inf
+    start = time.perf_counter()
+    while True:
+        call_start = time.perf_counter()
+        fn()
+        end = time.perf_counter()
+        best = min(best, end - call_start)
+        if end - start >= min_time:
+            return best
+
+
+def bench_track_generation(config, work_dir, min_time):
+    # Track generation, collision engine, state space and transition table, without the track cache
+    def generate():
+        cache_dir = tempfile.mkdtemp(dir=work_dir)
+        Racetrack(config).create_grid(cache_dir)
+        shutil.rmtree(cache_dir)
+    return best_time(generate, min_time)
+
+
+def bench_simulate(racetrack, config, min_time, n_episodes=20):
+    # Steps per second of simulating n_episodes episodes with the initial state values (the same episodes on every
+    # call), returns the paths too
+    rl = RLRacetrack(config, racetrack)
+    paths = []
+
+    def simulate():
+        paths.clear()
+        ep = Episode(racetrack, config['epsilon'], rl.state_values, config['min_speed_x'], config['max_speed_x'],
+                     config['min_speed_y'], config['max_speed_y'], config['delta'], config['max_episode_length'],
+                     rng=np.random.default_rng(config['seed']))
+        for _ in range(n_episodes):
+            path, _ = ep.simulate()
+            paths.append(path)
+    seconds = best_time(simulate, min_time)
+    return sum(len(path) for path in paths) / seconds, paths
+
+
+def bench_collision(racetrack, min_time, n=10000):
+    # Random moves from track cells, with velocities within the speed limits
+    rng = np.random.default_rng(0)
+    cells = racetrack.positions[rng.integers(len(racetrack.positions), size=n)]
+    vx = rng.integers(racetrack.min_speed_x, racetrack.max_speed_x + 1, size=n)
+    vy = rng.integers(racetrack.min_speed_y, racetrack.max_speed_y + 1, size=n)
+    moves = [((int(x), int(y)), (int(a), int(b))) for (x, y), a, b in zip(cells, vx, vy)]
+
+    def crash():
+        for position, velocity in moves:
+            racetrack.check_for_crash(position, velocity)
+
+    def finished():
+        for position, velocity in moves:
+            racetrack.has_finished(position, velocity)
+    return n / best_time(crash, min_time), n / best_time(finished, min_time)
+
+
+def bench_update_rules(racetrack, config, paths, min_time):
+    # Path entries per second of update_state_values, for every rule, on the paths of bench_simulate
+    results = {}
+    n_entries = sum(len(path) for path in paths)
+    for rule in UPDATE_RULES:
+        rl = RLRacetrack(dict(config, update_state_values_rule=rule), racetrack)
+
+        def update():
+            for path in paths:
+                rl.update_state_values(path)
+        results[f'update_{rule}_entries_per_sec'] = n_entries / best_time(update, min_time)
+    return results
+
+
+def bench_load_path(paths, work_dir, min_time, n_episodes=2000):
+    # Seconds to index a log of n_episodes episodes (the simulated paths repeated), and to parse all its episodes
+    # once indexed, starting from an empty episode cache, for every log format
+    results = {}
+    for log_format in ['csv', 'binary']:
+        filename = os.path.join(work_dir, log_filename('benchmark', log_format))
+        log = open_episode_log(filename, log_format)
+        for episode in range(n_episodes):
+            log.write_episode(episode + 1, paths[episode % len(paths)])
+        log.close()
+        view = View()
+        results[f'load_path_{log_format}_seconds'] = best_time(lambda: view.load_path(filename), min_time)
+
+        def parse():
+            view.episode_cache.clear()
+            for ep in range(view.episode_count()):
+                view.get_episode(ep)
+        results[f'parse_{log_format}_seconds'] = best_time(parse, min_time)
+    return results
+
+
+def run_benchmarks(grid_sizes=GRID_SIZES, speed_limits=SPEED_LIMITS, min_time=0.5):
+    work_dir = tempfile.mkdtemp(prefix='racetrack_benchmark_')
+    results = {}
+    try:
+        for size in grid_sizes:
+            for speed in speed_limits:
+                name = case_name(size, speed)
+                print(f'Benchmarking {name}')
+                config = case_config(size, speed)
+                case = {'track_generation_seconds': bench_track_generation(config, work_dir, min_time)}
+
+                racetrack = Racetrack(config)
+                racetrack.create_grid(work_dir)
+                case['simulate_steps_per_sec'], paths = bench_simulate(racetrack, config, min_time)
+                case['check_for_crash_calls_per_sec'], case['has_finished_calls_per_sec'] = \
+                    bench_collision(racetrack, min_time)
+                case.update(bench_update_rules(racetrack, config, paths, min_time))
+                case.update(bench_load_path(paths, work_dir, min_time))
+                results[name] = case
+    finally:
+        shutil.rmtree(work_dir)
+    return {
+        'timestamp': timestamp(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'min_time': min_time,
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Metrics of results worse than the baseline by more than tolerance (relative): list of
+    # (case, metric, baseline value, value, relative change, where > 0 is better)
+    regressions = []
+    for name, case in results['results'].items():
+        for metric, value in case.items():
+            base = baseline['results'].get(name, {}).get(metric)
+            if base is None:
+                continue
+            change = value / base - 1 if metric.endswith('_per_sec') else base / value - 1
+            print(f'{name:<20} {metric:<40} {base:>14.6g} {value:>14.6g} {change:>+8.1%}')
+            if change < -tolerance:
+                regressions.append((name, metric, base, value, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the simulator, learner and viewer hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=GRID_SIZES, help='grid sizes (square grids)')
+    parser.add_argument('--speeds', type=int, nargs='+', default=SPEED_LIMITS, help='speed limits')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds spent on every measurement')
+    parser.add_argument('--output', default=f'runs/benchmark_{timestamp()}.json', help='results file')
+    parser.add_argument('--baseline', help='results file to compare against, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown reported as regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.speeds, args.min_time)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, metric, base, value, change in regressions:
+            print(f'Regression: {name} {metric} {change:+.1%}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+# A checkpoint directory holds one sub-directory per saved checkpoint, with the state value arrays as .npy files
+# and the rest of the training state as JSON, plus a 'latest' file naming the last complete checkpoint.
+# Older checkpoints are removed once 'latest' points to the new one. A checkpoint is always written to a new
+# sub-directory: the arrays being saved may be memory-mapped from an existing one (see load_checkpoint)
+LATEST = 'latest'
+
+
+def save_checkpoint(directory, name, values: np.ndarray, counts: np.ndarray, state: dict):
+    os.makedirs(directory, exist_ok=True)
+    previous = latest_checkpoint(directory)
+    suffix = 0
+    while os.path.exists(os.path.join(directory, name if suffix == 0 else f'{name}_{suffix}')):
+        suffix += 1
+    name = name if suffix == 0 else f'{name}_{suffix}'
+    path = os.path.join(directory, name)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, 'values.npy'), values)
+    np.save(os.path.join(tmp_path, 'counts.npy'), counts)
+    with open(os.path.join(tmp_path, 'state.json'), 'w') as f:
+        json.dump(state, f)
+    os.rename(tmp_path, path)
+
+    tmp_latest = os.path.join(directory, f'{LATEST}.{os.getpid()}.tmp')
+    with open(tmp_latest, 'w') as f:
+        f.write(name)
+    os.replace(tmp_latest, os.path.join(directory, LATEST))
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+    return path
+
+
+def latest_checkpoint(directory):
+    # Path of the last complete checkpoint of directory, None if there is none
+    try:
+        with open(os.path.join(directory, LATEST)) as f:
+            return os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def load_checkpoint(directory):
+    # (values, counts, state) of the last checkpoint. The arrays are memory-mapped copy-on-write:
+    # training can update them without modifying the checkpoint
+    path = latest_checkpoint(directory)
+    if path is None:
+        raise FileNotFoundError(f'No checkpoint in {directory}')
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode='c')
+    counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='c')
+    with open(os.path.join(path, 'state.json')) as f:
+        state = json.load(f)
+    return values, counts, state
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class CollisionEngine:
+    def __init__(self, grid: np.ndarray, max_speed):
+        # Swept collision checks against the walls (0 cells) of a racetrack grid.
+        # wall_distance holds the Chebyshev distance to the closest wall, capped at max_speed + 1: every cell of the
+        # Bresenham line of a move lies within max(|vx|, |vy|) of its end cell, so a move ending farther than that
+        # from any wall cannot cross one, and only the moves ending near walls are rasterized
+        self.grid = grid
+        self.height, self.width = grid.shape
+        self.start = grid == 1
+        self.max_speed = max_speed
+        self.wall_distance = self.compute_wall_distance(min(max_speed + 1, 255))
+        # Flat bytes of the cells (index y * width + x) for the scalar checks: indexing them is much cheaper than
+        # indexing arrays, for one byte per cell
+        self._walls = (grid == 0).tobytes()
+        self._start = self.start.tobytes()
+        self._wall_distance = self.wall_distance.tobytes()
+
+    def compute_wall_distance(self, cap):
+        # One 3x3 dilation of the walls per distance
+        reached = self.grid == 0
+        distance = np.full(self.grid.shape, cap, dtype=np.uint8)
+        distance[reached] = 0
+        for d in range(1, cap):
+            dilated = reached.copy()
+            dilated[1:] |= reached[:-1]
+            dilated[:-1] |= reached[1:]
+            rows = dilated.copy()
+            dilated[:, 1:] |= rows[:, :-1]
+            dilated[:, :-1] |= rows[:, 1:]
+            distance[dilated & ~reached] = d
+            reached = dilated
+        return distance
+
+    def inside(self, x, y):
+        return (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+
+    def jumped_over_wall(self, position, velocity):
+        # A cell of the line from the previous position to position is outside the track.
+        # Moves ending on the start line never jump over a wall
+        x1, y1 = position
+        vx, vy = velocity
+        if 0 <= x1 < self.width and 0 <= y1 < self.height:
+            cell = y1 * self.width + x1
+            if self._start[cell]:
+                return False
+            if self._wall_distance[cell] > max(abs(vx), abs(vy)):
+                return False
+        return self.line_crosses_wall(x1 - vx, y1 - vy, x1, y1)
+
+    def line_crosses_wall(self, x0, y0, x1, y1):
+        # Scalar swept: Bresenham's algorithm on integers, as the bresenham package. Cells outside the grid are
+        # ignored
+        dx, dy = x1 - x0, y1 - y0
+        sign_x = 1 if dx > 0 else -1
+        sign_y = 1 if dy > 0 else -1
+        dx, dy = abs(dx), abs(dy)
+        if dx > dy:
+            xx, xy, yx, yy = sign_x, 0, 0, sign_y
+        else:
+            dx, dy = dy, dx
+            xx, xy, yx, yy = 0, sign_y, sign_x, 0
+
+        walls, width, height = self._walls, self.width, self.height
+        d = 2 * dy - dx
+        minor = 0
+        for major in range(dx + 1):
+            x = x0 + major * xx + minor * yx
+            y = y0 + major * xy + minor * yy
+            if 0 <= x < width and 0 <= y < height and walls[y * width + x]:
+                return True
+            if d >= 0:
+                minor += 1
+                d -= 2 * dx
+            d += 2 * dy
+        return False
+
+    def crash(self, position, velocity):
+        # Racetrack.check_for_crash: the car ends outside the track (or the grid) or jumped over a wall
+        x, y = position
+        return not (0 <= x < self.width and 0 <= y < self.height) or self._walls[y * self.width + x] == 1 or \
+            self.jumped_over_wall(position, velocity)
+
+    def crashes(self, x0, y0, vx, vy):
+        # Batched crash over arrays of moves from (x0, y0) with velocity (vx, vy)
+        x1, y1 = x0 + vx, y0 + vy
+        inside = self.inside(x1, y1)
+        rows, cols = np.where(inside, y1, 0), np.where(inside, x1, 0)
+        end_cell = self.grid[rows, cols]
+        crashed = ~inside | (end_cell == 0)
+        near_wall = ~crashed & (end_cell != 1) & (self.wall_distance[rows, cols] <= np.maximum(abs(vx), abs(vy)))
+        idx = np.flatnonzero(near_wall)
+        if len(idx):
+            crashed[idx] = self.swept(x0[idx], y0[idx], x1[idx], y1[idx])
+        return crashed
+
+    def swept(self, x0, y0, x1, y1):
+        # Rasterize the moves with Bresenham's algorithm (as the bresenham package), vectorized over the moves:
+        # the k-th cell along the major axis has a rounded offset along the minor axis. Cells outside the grid
+        # are ignored
+        dx, dy = x1 - x0, y1 - y0
+        x_major = np.abs(dx) > np.abs(dy)
+        major = np.maximum(np.abs(dx), np.abs(dy))
+        minor = np.minimum(np.abs(dx), np.abs(dy))
+        sign_x = np.where(dx > 0, 1, -1)
+        sign_y = np.where(dy > 0, 1, -1)
+        crashed = np.zeros(len(x0), dtype=bool)
+        for k in range(int(major.max(initial=0)) + 1):
+            active = ~crashed & (k <= major)
+            if not active.any():
+                break
+            offset = (2 * minor * k + major) // np.maximum(2 * major, 1)
+            x = x0 + np.where(x_major, k, offset) * sign_x
+            y = y0 + np.where(x_major, offset, k) * sign_y
+            on_grid = self.inside(x, y)
+            cell = self.grid[np.where(on_grid, y, 0), np.where(on_grid, x, 0)]
+            crashed |= active & on_grid & (cell == 0)
+        return crashed
@@ -1,11 +1,32 @@
-from racetrack import Racetrack
+from racetrack import Racetrack, ACTIONS, CRASH, FINISHED, OK
+from state_values import StateValues
 
+from array import array
 import random
+import time
+import numpy as np
+
+# Uniform random numbers drawn at a time by Episode
+RANDOM_BLOCK_SIZE = 4096
+NO_OP = ACTIONS.index((0, 0))
+
+
+def path_to_array(path):
+    # Convert a list of (position, velocity, action) to an int array of rows (x, y, vx, vy, action index)
+    return np.array([(pos[0], pos[1], vel[0], vel[1], -1 if action is None else ACTIONS.index(action))
+                     for pos, vel, action in path], dtype=np.int32).reshape(-1, 5)
 
 
 class Episode:
-    def __init__(self, racetrack: Racetrack, epsilon, state_values, min_speed_x, max_speed_x, min_speed_y, max_speed_y,
-                 delta, max_episode_length, random_start=True):
+    __slots__ = ('racetrack', 'epsilon', 'state_values', 'min_speed_x', 'max_speed_x', 'min_speed_y', 'max_speed_y',
+                 'delta', 'max_episode_length', 'rng', '_random_start', '_fixed_start', '_start_positions',
+                 '_possible_actions', '_velocity_steps', '_transitions', '_position_index', '_uniforms',
+                 '_next_uniform', '_block_state', '_path')
+
+    def __init__(self, racetrack: Racetrack, epsilon, state_values: StateValues, min_speed_x, max_speed_x, min_speed_y, max_speed_y,
+                 delta, max_episode_length, random_start=True, rng: np.random.Generator = None):
+        # Simulates episodes one step at a time: no-op with probability delta, otherwise epsilon-greedy on the state
+        # values (ties broken by count, then at random). Can be reused for several episodes
         self.racetrack = racetrack
         self.epsilon = epsilon
         self.state_values = state_values
@@ -15,88 +36,208 @@ class Episode:
         self.max_speed_y = max_speed_y
         self.delta = delta
         self.max_episode_length = max_episode_length
+        # By default, a generator seeded from the random module (seeded by the track generator)
+        self.rng = np.random.default_rng(random.getrandbits(64)) if rng is None else rng
 
         self._random_start = random_start
         start_point = racetrack.start_positions[int(len(racetrack.start_positions) / 2)]
         self._fixed_start = start_point[1], start_point[0]
-
-        self._path = []
-
-        self._current_pos = None  # (x, y) pairs of integers
-        self._current_velocity = None  # (vx, vy) pair of integers
-
-    def get_possible_actions(self):
-        # Velocity should be positive, <= 5
-        # Compute based on self._current_velocity, self._current_pos
-        vx, vy = self._current_velocity
-
-        deltas_vx = [-1, 0, 1]
-        deltas_vy = [-1, 0, 1]
-
-        if vx == self.min_speed_x:
-            deltas_vx.remove(-1)
-        if vx == self.max_speed_x:
-            deltas_vx.remove(1)
-
-        if vy == self.min_speed_y:
-            deltas_vy.remove(-1)
-        if vy == self.max_speed_y:
-            deltas_vy.remove(1)
-
-        # remove action that leads to (vx, vy) = (0, 0)
-        possible_actions = [(delta_vx, delta_vy) for delta_vx in deltas_vx for delta_vy in deltas_vy if
-                            ((delta_vx + vx != 0) or (delta_vy + vy != 0))]
-        random.shuffle(possible_actions)
-        return possible_actions
-
-    def choose_action(self, possible_actions):
-        # Choose action based on epsilon-greedy policy. Return (position, speed, action)
-        if random.random() < self.delta:
-            action = (0, 0)
-        elif random.random() < self.epsilon:
-            action = random.choice(possible_actions)
-        else:
-            action = max(possible_actions, key=lambda a: self.state_values[
-                (self._current_pos, (self._current_velocity[0] + a[0], self._current_velocity[1] + a[1]))])
-
-        new_velocity = (self._current_velocity[0] + action[0], self._current_velocity[1] + action[1])
-        new_position = (self._current_pos[0] + new_velocity[0], self._current_pos[1] + new_velocity[1])
-        return new_position, new_velocity, action
-
-    def go_to_start(self):
-        # Go back to the start position
-        y, x = random.choice(self.racetrack.start_positions)
-        return (x, y), self.random_velocity()
-
-    def random_velocity(self):
-        return 0, random.choice(range(self.min_speed_y, self.max_speed_y + 1))
-
-    def write_to_file(self, file):
-        file.write(f'{self._current_pos[0]}, {self._current_pos[1]}, '
-                   f'{self._current_velocity[0]}, {self._current_velocity[1]},\n')
-
-    def simulate(self, file):
-        if self._random_start:
-            self._current_pos, self._current_velocity = self.go_to_start()
-        else:
-            self._current_pos, self._current_velocity = \
-                self._fixed_start, self.random_velocity()
-        self._current_pos, self._current_velocity = self.go_to_start()
-        self._path.append((self._current_pos, self._current_velocity, None))
+        self._start_positions = [(x, y) for y, x in racetrack.start_positions]
+
+        # Possible actions (indices in ACTIONS) of every velocity index, the same at every position (see
+        # Racetrack.action_moves), and the change of the velocity index of every action
+        n_velocities, n_velocities_y = racetrack.n_velocities, racetrack.n_velocities_y
+        self._possible_actions = [np.flatnonzero(moves >= 0).tolist() for moves in racetrack.action_moves]
+        self._velocity_steps = [delta_vx * n_velocities_y + delta_vy for delta_vx, delta_vy in ACTIONS]
+        # Plain Python sequences of the static tables, shared by the episodes of the racetrack: indexing them is
+        # cheaper than indexing arrays
+        self._transitions = racetrack.transition_lookup
+        self._position_index = racetrack.position_lookup
+
+        # Block of uniform random numbers, the next one to use and the state of the generator before the block
+        self._uniforms = []
+        self._next_uniform = 0
+        self._block_state = None
+        self._path = array('i')  # rows (x, y, vx, vy, action index), the buffer is kept between episodes
+
+    def simulate(self, file=None, timers=None):
+        # Returns the path as an int array of rows (x, y, vx, vy, action index) (see path_to_array), and whether
+        # the episode reached the finish line before max_episode_length. With timers (phase -> seconds, e.g.
+        # Profiler.timers), the seconds spent in action selection, move outcomes and resets are added to them
+        duration = self._run() if timers is None else self._run_timed(timers)
+        rows = np.frombuffer(self._path, dtype=np.int32).reshape(-1, 5).copy()
+        if file is not None:
+            file.write(''.join(f'{x}, {y}, {vx}, {vy},\n' for x, y, vx, vy, _ in rows.tolist()))
+        return rows, duration < self.max_episode_length
+
+    def _run(self):
+        # Simulate an episode into the path buffer, returns its duration
+        racetrack = self.racetrack
+        width = racetrack.position_index.shape[1]
+        n_velocities, n_velocities_y = racetrack.n_velocities, racetrack.n_velocities_y
+        min_speed_x, min_speed_y = racetrack.min_speed_x, racetrack.min_speed_y
+        n_start_velocities = racetrack.max_speed_y - min_speed_y + 1
+        start_positions, n_start_positions = self._start_positions, len(self._start_positions)
+        transitions, position_index = self._transitions, self._position_index
+        possible_actions, velocity_steps = self._possible_actions, self._velocity_steps
+        greedy, values, counts = self.state_values.greedy, self.state_values.values, self.state_values.counts
+        delta, epsilon, max_episode_length = self.delta, self.epsilon, self.max_episode_length
+        uniforms, u = self._uniforms, self._next_uniform
+        path = self._path
+        del path[:]
+
+        x = y = vx = vy = p = v = 0
         duration = 0
-        self.write_to_file(file)
-
-        while not self.racetrack.has_finished(self._current_pos, self._current_velocity) and \
-                duration < self.max_episode_length:
-            if self.racetrack.check_for_crash(self._current_pos, self._current_velocity):
-                self._current_pos, self._current_velocity = self.go_to_start()
-                self._path.append((self._current_pos, self._current_velocity, None))
-                self.write_to_file(file)
-
-            possible_actions = self.get_possible_actions()
-            self._current_pos, self._current_velocity, action = self.choose_action(possible_actions)
-            self._path.append((self._current_pos, self._current_velocity, action))
+        outcome = None  # None before the start, then the outcome of the last move
+        while outcome != FINISHED and duration < max_episode_length:
+            # A step draws at most 5 random numbers: 2 for a restart, 3 for the action
+            if u + 5 > len(uniforms):
+                uniforms, u = self.draw_block(), 0
+
+            if outcome is None or outcome == CRASH:
+                if outcome is None and not self._random_start:
+                    x, y = self._fixed_start
+                else:
+                    x, y = start_positions[int(uniforms[u] * n_start_positions)]
+                    u += 1
+                vx, vy = 0, min_speed_y + int(uniforms[u] * n_start_velocities)
+                u += 1
+                p = position_index[y * width + x]
+                v = (vx - min_speed_x) * n_velocities_y + vy - min_speed_y
+                path.extend((x, y, vx, vy, -1))
+
+            if uniforms[u] < delta:
+                action = NO_OP
+                u += 1
+            elif uniforms[u + 1] < epsilon:
+                candidates = possible_actions[v]
+                action = candidates[int(uniforms[u + 2] * len(candidates))]
+                u += 3
+            else:
+                state = p * n_velocities + v
+                action = int(greedy[state])
+                if action < 0:
+                    # Tied in the greedy table: one of the best (value, count) moves at random
+                    candidates = possible_actions[v]
+                    keys = [(values[state + velocity_steps[a]], counts[state + velocity_steps[a]]) for a in candidates]
+                    best_key = max(keys)
+                    best = [a for a, key in zip(candidates, keys) if key == best_key]
+                    action = best[int(uniforms[u + 2] * len(best))]
+                    u += 3
+                else:
+                    u += 2
+
+            delta_vx, delta_vy = ACTIONS[action]
+            v += velocity_steps[action]
+            outcome = transitions[p * n_velocities + v]
+            vx += delta_vx
+            vy += delta_vy
+            x += vx
+            y += vy
+            if outcome == OK:
+                p = position_index[y * width + x]
+            path.extend((x, y, vx, vy, action))
+            duration += 1
 
-            self.write_to_file(file)
+        self._uniforms, self._next_uniform = uniforms, u
+        return duration
+
+    def _run_timed(self, timers):
+        # Same as _run, timing its phases: slower, only used to profile
+        racetrack = self.racetrack
+        width = racetrack.position_index.shape[1]
+        n_velocities, n_velocities_y = racetrack.n_velocities, racetrack.n_velocities_y
+        min_speed_x, min_speed_y = racetrack.min_speed_x, racetrack.min_speed_y
+        n_start_velocities = racetrack.max_speed_y - min_speed_y + 1
+        start_positions, n_start_positions = self._start_positions, len(self._start_positions)
+        transitions, position_index = self._transitions, self._position_index
+        possible_actions, velocity_steps = self._possible_actions, self._velocity_steps
+        greedy, values, counts = self.state_values.greedy, self.state_values.values, self.state_values.counts
+        delta, epsilon, max_episode_length = self.delta, self.epsilon, self.max_episode_length
+        uniforms, u = self._uniforms, self._next_uniform
+        path = self._path
+        del path[:]
+
+        perf_counter = time.perf_counter
+        reset_time = action_time = move_time = 0.0
+        x = y = vx = vy = p = v = 0
+        duration = 0
+        outcome = None  # None before the start, then the outcome of the last move
+        while outcome != FINISHED and duration < max_episode_length:
+            # A step draws at most 5 random numbers: 2 for a restart, 3 for the action
+            if u + 5 > len(uniforms):
+                uniforms, u = self.draw_block(), 0
+
+            if outcome is None or outcome == CRASH:
+                start = perf_counter()
+                if outcome is None and not self._random_start:
+                    x, y = self._fixed_start
+                else:
+                    x, y = start_positions[int(uniforms[u] * n_start_positions)]
+                    u += 1
+                vx, vy = 0, min_speed_y + int(uniforms[u] * n_start_velocities)
+                u += 1
+                p = position_index[y * width + x]
+                v = (vx - min_speed_x) * n_velocities_y + vy - min_speed_y
+                path.extend((x, y, vx, vy, -1))
+                reset_time += perf_counter() - start
+
+            start = perf_counter()
+            if uniforms[u] < delta:
+                action = NO_OP
+                u += 1
+            elif uniforms[u + 1] < epsilon:
+                candidates = possible_actions[v]
+                action = candidates[int(uniforms[u + 2] * len(candidates))]
+                u += 3
+            else:
+                state = p * n_velocities + v
+                action = int(greedy[state])
+                if action < 0:
+                    # Tied in the greedy table: one of the best (value, count) moves at random
+                    candidates = possible_actions[v]
+                    keys = [(values[state + velocity_steps[a]], counts[state + velocity_steps[a]]) for a in candidates]
+                    best_key = max(keys)
+                    best = [a for a, key in zip(candidates, keys) if key == best_key]
+                    action = best[int(uniforms[u + 2] * len(best))]
+                    u += 3
+                else:
+                    u += 2
+
+            selected = perf_counter()
+            action_time += selected - start
+
+            delta_vx, delta_vy = ACTIONS[action]
+            v += velocity_steps[action]
+            outcome = transitions[p * n_velocities + v]
+            vx += delta_vx
+            vy += delta_vy
+            x += vx
+            y += vy
+            if outcome == OK:
+                p = position_index[y * width + x]
+            path.extend((x, y, vx, vy, action))
             duration += 1
-        return self._path, duration < self.max_episode_length
+            move_time += perf_counter() - selected
+
+        self._uniforms, self._next_uniform = uniforms, u
+        timers['reset'] += reset_time
+        timers['action_selection'] += action_time
+        timers['move_outcome'] += move_time  # crash and finish detection, moving the car
+        return duration
+
+    def draw_block(self):
+        self._block_state = self.rng.bit_generator.state
+        self._uniforms = self.rng.random(RANDOM_BLOCK_SIZE).tolist()
+        return self._uniforms
+
+    def get_random_state(self):
+        # JSON-serializable state of the random numbers, see set_random_state
+        return {'block_state': self._block_state, 'next_uniform': self._next_uniform}
+
+    def set_random_state(self, state):
+        # Continue with the random numbers of the simulator the state was taken from
+        if state['block_state'] is not None:
+            self.rng.bit_generator.state = state['block_state']
+            self.draw_block()
+        self._next_uniform = state['next_uniform']
@@ -0,0 +1,188 @@
+from array import array
+from collections import deque
+import os
+import queue
+import threading
+
+import numpy as np
+
+# Binary episode log: a header, fixed-width int16 records (x, y, vx, vy, action index) for every step of every
+# episode, then an index with the first record of every episode (plus the total number of records) and the
+# episode numbers. Offsets are in records
+MAGIC = b'RTRKLOG1'
+HEADER = np.dtype([('magic', 'S8'), ('n_records', '<i8'), ('n_episodes', '<i8'), ('index_offset', '<i8')])
+RECORD = np.dtype('<i2')
+RECORD_FIELDS = 5
+
+EXTENSIONS = {'csv': '.csv', 'binary': '.bin'}
+
+# Episodes kept in the log: all of them, every sample-th one, the first and last sample ones, or none
+LOG_LEVELS = ['full', 'every', 'first_last', 'off']
+BUFFER_SIZE = 1 << 20  # bytes buffered by the log files between writes
+
+
+def log_filename(filename, log_format='csv'):
+    # Replace the extension of filename by the one of the log format
+    return os.path.splitext(filename)[0] + EXTENSIONS[log_format]
+
+
+def open_episode_log(filename, log_format='csv', level='full', sample=100, background=False):
+    # Episode log of the given format, keeping the episodes of the level (see LOG_LEVELS); with background, the
+    # episodes are written by a writer thread (see BackgroundEpisodeLog). No file is created when level is 'off'
+    if level not in LOG_LEVELS:
+        raise ValueError(f'Unknown log level {level}')
+    if level == 'off':
+        return NullEpisodeLog()
+    if log_format == 'csv':
+        log = TextEpisodeLog(filename)
+    elif log_format == 'binary':
+        log = BinaryEpisodeLog(filename)
+    else:
+        raise ValueError(f'Unknown log format {log_format}')
+    if background:
+        log = BackgroundEpisodeLog(log)
+    if level != 'full':
+        log = SampledEpisodeLog(log, level, sample)
+    return log
+
+
+def is_binary_log(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class TextEpisodeLog:
+    def __init__(self, filename):
+        # One 'Episode N' line per episode followed by one 'x, y, vx, vy,' line per step
+        self.file = open(filename, 'w', buffering=BUFFER_SIZE)
+
+    def write_episode(self, episode, path: np.ndarray):
+        # path: int array of rows (x, y, vx, vy, action index)
+        self.file.write(f'Episode {episode}\n')
+        self.file.write(('%d, %d, %d, %d,\n' * len(path)) % tuple(path[:, :4].ravel().tolist()))
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryEpisodeLog:
+    def __init__(self, filename):
+        self.file = open(filename, 'wb', buffering=BUFFER_SIZE)
+        self.file.write(np.zeros(1, dtype=HEADER).tobytes())
+        self.offsets = array('q', [0])
+        self.episodes = array('q')
+
+    def write_episode(self, episode, path: np.ndarray):
+        self.file.write(np.ascontiguousarray(path, dtype=RECORD).tobytes())
+        self.offsets.append(self.offsets[-1] + len(path))
+        self.episodes.append(episode)
+
+    def close(self):
+        index_offset = self.file.tell()
+        self.file.write(self.offsets.tobytes())
+        self.file.write(self.episodes.tobytes())
+        header = np.array([(MAGIC, self.offsets[-1], len(self.episodes), index_offset)], dtype=HEADER)
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.close()
+
+
+class NullEpisodeLog:
+    def write_episode(self, episode, path: np.ndarray):
+        pass
+
+    def close(self):
+        pass
+
+
+class SampledEpisodeLog:
+    def __init__(self, log, level, sample):
+        # Forward to log the episodes of the level: 'every' sample-th episode (starting with the first one), or the
+        # 'first_last' sample episodes. The last ones are only known at the end: they are kept in memory until close
+        self.log = log
+        self.level = level
+        self.sample = sample
+        self.n_episodes = 0
+        self.last = deque(maxlen=sample)
+
+    def write_episode(self, episode, path: np.ndarray):
+        self.n_episodes += 1
+        if self.level == 'every':
+            if (self.n_episodes - 1) % self.sample == 0:
+                self.log.write_episode(episode, path)
+        elif self.n_episodes <= self.sample:
+            self.log.write_episode(episode, path)
+        else:
+            self.last.append((episode, path))
+
+    def close(self):
+        for episode, path in self.last:
+            self.log.write_episode(episode, path)
+        self.log.close()
+
+
+class BackgroundEpisodeLog:
+    def __init__(self, log, max_queued=256):
+        # Hand the episodes over to a thread writing them to log, through a queue of at most max_queued episodes:
+        # the paths must not be modified once written. Errors of the writer are raised by the next call
+        self.log = log
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.error = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is None:
+                try:
+                    self.log.write_episode(*item)
+                except Exception as e:
+                    self.error = e
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write_episode(self, episode, path: np.ndarray):
+        self._raise_error()
+        self.queue.put((episode, path))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.log.close()
+        self._raise_error()
+
+
+class EpisodeLogReader:
+    def __init__(self, filename):
+        # Memory-map a binary episode log: episodes are read without parsing nor loading the whole file
+        header = np.fromfile(filename, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError(f'{filename} is not a binary episode log')
+        n_records, n_episodes = int(header['n_records']), int(header['n_episodes'])
+        index_offset = int(header['index_offset'])
+
+        self.records = np.memmap(filename, dtype=RECORD, mode='r', offset=HEADER.itemsize,
+                                 shape=(n_records, RECORD_FIELDS)) if n_records else \
+            np.zeros((0, RECORD_FIELDS), dtype=RECORD)
+        index = np.memmap(filename, dtype='<i8', mode='r', offset=index_offset, shape=(2 * n_episodes + 1,))
+        self.offsets = index[:n_episodes + 1]
+        self.episode_numbers = index[n_episodes + 1:]
+
+    def __len__(self):
+        return len(self.episode_numbers)
+
+    def episode(self, i):
+        # Records (x, y, vx, vy, action index) of the i-th episode stored in the log
+        return self.records[self.offsets[i]:self.offsets[i + 1]]
+
+    def export_csv(self, filename):
+        # Write the log in the text format
+        log = TextEpisodeLog(filename)
+        for i in range(len(self)):
+            log.write_episode(int(self.episode_numbers[i]), self.episode(i))
+        log.close()
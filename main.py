@@ -1,6 +1,7 @@
+from episode_log import log_filename
 from racetrack import Racetrack
 from rl_racetrack import RLRacetrack
-from view import View
+from utils import timestamp
 import yaml
 
 if __name__ == '__main__':
@@ -15,14 +16,21 @@ if __name__ == '__main__':
 
     rl_racetrack = RLRacetrack(config, track)
 
-    logs = 'runs_' + grid_file.lstrip('grid_')
+    logs = log_filename(f'runs_{timestamp()}', config.get('log_format', 'csv'))
     rl_racetrack.run('runs/' + logs)
     rl_racetrack.report()
 
-    visualization = View()
+    # Nothing to show when no episode was logged
+    if rl_racetrack.log_level != 'off':
+        from view import View  # pygame is only imported to show the episodes
 
-    visualization.load_map('runs/'+grid_file)
-    visualization.load_path('runs/'+logs)
+        visualization = View()
 
-    visualization.show()
+        visualization.set_map(track.grid)
+        visualization.load_path('runs/'+logs)
 
+        if config.get('headless', False):
+            # No display: save the last frame of the episodes show would play
+            visualization.export_frames(visualization.sampled_episodes(10), 'runs/frames', final_only=True)
+        else:
+            visualization.show()
@@ -1,25 +1,49 @@
-from racetrack import Racetrack
+from report import start_report
+from result_store import ResultStore, result_record
+from train import train
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import product
-import pandas as pd
-import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
+import json
+import os
 import yaml
 import time
 
-from rl_racetrack import RLRacetrack
-from utils import mov_avg
+from utils import show_or_save, timestamp
+
+
+def plot_curves(curves, window, filename=None):
+    # curves: execution name -> (episodes, moving averages of the returns over window episodes). Executions may
+    # have different lengths and curve resolutions: the curves are plotted in long format. Shown, or saved to filename
+    import pandas as pd  # plotting libraries are only imported by the report
+    import seaborn as sns
+
+    df = pd.concat([pd.DataFrame({'episode': episodes, 'value': moving_average, 'settings': name})
+                    for name, (episodes, moving_average) in curves.items()], ignore_index=True)
+    sns.lineplot(data=df, x='episode', y='value', hue='settings').set(
+        title=f'Episode returns by execution (MA = {window})', xlabel='Episode', ylabel='Episode return')
+    show_or_save(filename)
 
 
 class MultipleRL:
-    def __init__(self, params_to_try, how='one_vs_base'):
+    def __init__(self, params_to_try, how='one_vs_base', n_workers=1, report_dir=None, results_dir='runs/results',
+                 report_runs=False):
         self._base_config = yaml.load(open('config.yaml', 'r'), Loader=yaml.FullLoader)
         self._params_to_try = params_to_try
         self._how = how  # 'one_vs_base' or 'cross'
+        self._n_workers = n_workers  # number of processes running configurations in parallel
+
+        # Names the run directories and checkpoints of the executions: one per execution, even in parallel
+        self._sweep_id = f'{timestamp()}_{os.getpid()}'
+        # Directory of the sweep, runs/sweep_<sweep id> by default: the run directories of the executions
+        # (run_<i>, see train.train) and the comparison of the executions (sweep.png). With report_runs, the figures
+        # of every run are rendered in the background once the sweep is over (see report.start_report)
+        self._report_dir = os.path.join('runs', f'sweep_{self._sweep_id}') if report_dir is None else report_dir
+        self._report_runs = report_runs
 
-        self._results = {}
-        self._runtimes = {}
+        # Results of the executions by configuration (see ResultStore): configurations already run by a previous
+        # sweep, even an interrupted one, are not run again
+        self._store = ResultStore(results_dir)
 
     def run(self):
         if self._how == 'one_vs_base':
@@ -28,68 +52,102 @@ class MultipleRL:
             self._run_cross()
 
     def _run_one_vs_base(self):
+        executions = []
         for param_name, param_values in self._params_to_try.items():
             for param_value in param_values:
-                print(f'Running with {param_name} = {param_value}')
                 config = self._base_config.copy()
                 config[param_name] = param_value
-                results, runtime = self.run_with_config(config, report=False)
-                self._results[f'{param_name} = {param_value}'] = results
-                self._runtimes[f'{param_name} = {param_value}'] = runtime
-        self._final_report()
+                executions.append((f'{param_name} = {param_value}', config))
+        self._run_executions(executions)
+        self._final_report(executions)
 
     def _run_cross(self):
+        executions = []
         configurations = list(product(*self._params_to_try.values()))
         for settings in configurations:
-            print(f'Running with {self._params_to_try.keys()} = {settings}')
             config = self._base_config.copy()
             for i, param_name in enumerate(self._params_to_try.keys()):
                 config[param_name] = settings[i]
-            results, runtime = self.run_with_config(config, report=False)
             exec_name = ', '.join([f'{param_name} = {param_value}'
                                    for param_name, param_value in zip(self._params_to_try.keys(), settings)])
-            self._results[exec_name] = results
-            self._runtimes[exec_name] = runtime
-        self._final_report()
-
-    def _final_report(self):
-        for name, results in self._results.items():
+            executions.append((exec_name, config))
+        self._run_executions(executions)
+        self._final_report(executions)
+
+    def _run_executions(self, executions):
+        # Run the (name, config) executions without a result in the store, in a process pool if n_workers > 1.
+        # The result of every execution is stored as soon as it finishes
+        pending = []
+        for i, (exec_name, config) in enumerate(executions):
+            if config in self._store:
+                print(f'Skipping {exec_name}: already run')
+            else:
+                pending.append((exec_name, config, f'{self._sweep_id}_{i}', os.path.join(self._report_dir, f'run_{i}')))
+
+        if self._n_workers > 1:
+            with ProcessPoolExecutor(max_workers=self._n_workers) as executor:
+                futures = {executor.submit(self.run_with_config, config, False, run_name, run_dir): (exec_name, config)
+                           for exec_name, config, run_name, run_dir in pending}
+                for future in as_completed(futures):
+                    exec_name, config = futures[future]
+                    print(f'Finished {exec_name}')
+                    self._store.save(result_record(config, *future.result()))
+        else:
+            for exec_name, config, run_name, run_dir in pending:
+                print(f'Running with {exec_name}')
+                self._store.save(result_record(config, *self.run_with_config(config, report=False, run_name=run_name,
+                                                                              run_dir=run_dir)))
+
+    def _final_report(self, executions):
+        # Compare the executions from their stored records, read one at a time: only the downsampled curves are
+        # kept. Executions may stop after different numbers of episodes (see RLRacetrack.should_stop)
+        curves, profiles, run_dirs, window = {}, {}, [], None
+        for (name, _), record in zip(executions, self._store.records(config for _, config in executions)):
+            last_average = record['last_window_average']
             print(f'\nExecution: {name}')
-            print(f'    Number of episodes: {len(results)}')
-            print(f'    Average return: {sum(results) / len(results)}')
-            print(f'    Last 100 average return: {sum(results[-100:]) / 100 if len(results) >= 100 else "N/A"}')
-            print(f'    Runtime: {self._runtimes[name]}')
-
-        # make all results lists the same length
-        max_episodes = max([len(results) for results in self._results.values()])
-        mov_avg_window = 100
-        for execution in self._results.keys():
-            # Compute 100 moving average using numpy convolve
-            self._results[execution] = mov_avg(self._results[execution], mov_avg_window)
-            self._results[execution] += [np.nan] * (max_episodes - len(self._results[execution]))
-
-        df = pd.DataFrame(self._results)
-        df['episode'] = df.index
-        sns.lineplot(data=df.melt(id_vars='episode', var_name='settings'), x='episode', y='value', hue='settings').set(
-            title=f'Episode returns by execution (MA = {mov_avg_window})', xlabel='Episode', ylabel='Episode return')
-        plt.show()
+            print(f'    Number of episodes: {record["episodes"]} (stopped by {record["stop_reason"]})')
+            print(f'    Average return: {record["average_return"]}')
+            print(f'    Last {record["window"]} average return: {"N/A" if last_average is None else last_average}')
+            print(f'    Runtime: {record["runtime"]}')
+
+            curves[name] = (record['curve']['episodes'], record['curve']['moving_average'])
+            window = record['window'] if window is None else window
+            if record['profile'] is not None:
+                profiles[name] = record['profile']
+            if record.get('run_dir') is not None and os.path.isdir(record['run_dir']):
+                run_dirs.append(record['run_dir'])
+
+        if profiles:
+            with open(f'runs/profiles_{self._sweep_id}.json', 'w') as f:
+                json.dump(profiles, f, indent=2)
+
+        os.makedirs(self._report_dir, exist_ok=True)
+        filename = os.path.join(self._report_dir, 'sweep.png')
+        plot_curves(curves, window, filename)
+        print(f'\nComparison of the executions saved to {filename}')
+        if self._report_runs and run_dirs:
+            start_report(run_dirs)
 
     @staticmethod
-    def run_with_config(config, report=True):
+    def run_with_config(config, report=True, run_name=None, run_dir=None):
+        # Train and save the artifacts of the run in run_dir (see train.train), runs/run_<run_name> by default.
+        # run_name also names the checkpoint sub-directory of the execution in the checkpoint_dir of the config (if
+        # set), by default it is the current time. With report, the report figures are saved in run_dir/report
         start_time = time.time()
+        run_name = timestamp() if run_name is None else run_name
+        run_dir = os.path.join('runs', f'run_{run_name}') if run_dir is None else run_dir
+        if config.get('checkpoint_dir') is not None:
+            # Executions sharing the checkpoint directory would remove the checkpoints of each other
+            config = dict(config, checkpoint_dir=os.path.join(config['checkpoint_dir'], run_name))
 
-        track = Racetrack(config)
-        grid_file = track.create_grid()
-
-        rl_racetrack = RLRacetrack(config, track)
-
-        logs = 'runs_' + grid_file.lstrip('grid_')
-        rl_racetrack.run('runs/' + logs)
+        rl_racetrack = train(config, run_dir)
 
         if report:
-            rl_racetrack.report()
+            os.makedirs(os.path.join(run_dir, 'report'), exist_ok=True)
+            rl_racetrack.report(os.path.join(run_dir, 'report'))
 
-        return rl_racetrack.episode_returns, time.time() - start_time
+        profile = None if rl_racetrack.profiler is None else rl_racetrack.profiler.to_dict()
+        return rl_racetrack.stats, time.time() - start_time, rl_racetrack.stop_reason, profile, run_dir
 
 
 if __name__ == '__main__':
@@ -97,5 +155,5 @@ if __name__ == '__main__':
         'update_state_values_rule': ['last_visit', 'last_visit_best'],
     }
 
-    multipleRL = MultipleRL(to_try, how='cross')
+    multipleRL = MultipleRL(to_try, how='cross', report_runs=True)
     multipleRL.run()
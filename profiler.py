@@ -0,0 +1,59 @@
+from racetrack import CRASH
+
+from collections import defaultdict
+from functools import wraps
+import json
+import time
+
+
+class Profiler:
+    def __init__(self):
+        # Cumulative seconds by phase and counters of a run. Methods are timed by replacing them on the instance
+        # (see instrument): nothing changes when profiling is disabled
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def timed(self, fn, phase):
+        timers = self.timers
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timers[phase] += time.perf_counter() - start
+        return wrapper
+
+    def instrument(self, obj, method, phase):
+        # Time the calls of obj.method as phase
+        setattr(obj, method, self.timed(getattr(obj, method), phase))
+
+    def record_episode(self, racetrack, path, reached_end):
+        # Counters of a path array (rows x, y, vx, vy, action index): every entry without action but the first one
+        # is a reset after a crash, and a truncated episode may end with a crash
+        starts = int((path[:, 4] == -1).sum())
+        self.counters['episodes'] += 1
+        self.counters['path_entries'] += len(path)
+        self.counters['steps'] += len(path) - starts
+        self.counters['resets'] += starts - 1
+        self.counters['crashes'] += starts - 1
+        if reached_end:
+            self.counters['finished_episodes'] += 1
+        else:
+            self.counters['truncated_episodes'] += 1
+            x, y, vx, vy, action = path[-1]
+            if action >= 0 and racetrack.move_outcome((x - vx, y - vy), (vx, vy)) == CRASH:
+                self.counters['crashes'] += 1
+
+    def to_dict(self):
+        episodes = self.counters['episodes']
+        return {
+            'timers': dict(self.timers),
+            'counters': dict(self.counters),
+            'average_episode_length': self.counters['path_entries'] / episodes if episodes else None,
+        }
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -1,7 +1,22 @@
+from array import array
 import random
-from utils import closed_segment_intersect
-import datetime
+from utils import closed_segment_intersect_batch, crosses_vertical_segment
 from bresenham import bresenham
+from collision import CollisionEngine
+import hashlib
+import json
+import numpy as np
+import os
+
+# Outcome of a move, see Racetrack.compute_transitions
+OK, CRASH, FINISHED = 0, 1, 2
+
+# All the (delta vx, delta vy) actions. In path arrays an action is stored as its index, -1 for no action
+ACTIONS = [(delta_vx, delta_vy) for delta_vx in [-1, 0, 1] for delta_vy in [-1, 0, 1]]
+
+# Parameters of the track generator, part of the cache key of the generated tracks (bump the version when the
+# generator changes)
+GENERATOR_PARAMS = {'version': 1, 'min_space': 5, 'min_width': 5}
 
 
 class Racetrack:
@@ -14,15 +29,131 @@ class Racetrack:
         self.seed = config['seed']
         self.end_positions = []
         self.finish_line_endpoints = None
+        self.finish_line = None  # (x, min y, max y) of the vertical finish line
         self.max_x = None
 
-    def create_grid(self):
-        self.create_empty_grid()
-        self.draw_grid_edges()
-        grid_file = self.store_grid()
+        # State space: drivable positions x velocities, see compute_state_space
+        self.min_speed_x = config['min_speed_x']
+        self.max_speed_x = config['max_speed_x']
+        self.min_speed_y = config['min_speed_y']
+        self.max_speed_y = config['max_speed_y']
+        self.n_velocities_y = self.max_speed_y - self.min_speed_y + 1
+        self.n_velocities = (self.max_speed_x - self.min_speed_x + 1) * self.n_velocities_y
+        self.position_index = None  # [y, x] -> index of the drivable position, -1 if outside
+        self.positions = None  # index of the drivable position -> (x, y)
+        self.n_states = None
+        self.transitions = None  # state index -> outcome (OK, CRASH, FINISHED) of the move
+        self.move_crashes = None  # state index -> whether the move crashes, even when it also finishes
+        self.action_moves = None  # velocity index, action index -> velocity index of the move, see compute_action_moves
+        self.collision = None  # CollisionEngine of the grid
+
+    def create_grid(self, directory='runs'):
+        # Generated tracks are cached in directory, in a file named after the hash of the generator inputs
+        # The generator seeds the global random module, the episodes then draw from it: loading a cached track leaves
+        # the random module in the same state as generating it
+        grid_file = f'grid_{self.track_hash()}.npz'
+        if os.path.exists(os.path.join(directory, grid_file)):
+            self.load_grid(os.path.join(directory, grid_file))
+        else:
+            self.create_empty_grid()
+            self.draw_grid_edges(GENERATOR_PARAMS['min_space'], GENERATOR_PARAMS['min_width'])
+            self.store_grid(os.path.join(directory, grid_file))
         self.compute_finish_line_endpoints()
+        self.collision = CollisionEngine(self.grid, max(abs(self.min_speed_x), abs(self.max_speed_x),
+                                                        abs(self.min_speed_y), abs(self.max_speed_y)))
+        self.compute_state_space()
+        self.compute_action_moves()
+        self.compute_transitions()
         return grid_file
 
+    def compute_state_space(self):
+        # Index the drivable cells (start, inside and finish) so that every state
+        # (x, y, vx, vy) maps to a flat index: position_index * n_velocities + velocity_index
+        ys, xs = np.nonzero(self.grid != 0)
+        self.position_index = np.full(self.grid.shape, -1, dtype=np.int64)
+        self.position_index[ys, xs] = np.arange(len(ys))
+        # Flat position_index (index y * width + x) for the scalar lookups (e.g. by Episode), indexing it is cheaper
+        # than indexing the array
+        self.position_lookup = array('i', bytes(4 * self.position_index.size))
+        np.frombuffer(self.position_lookup, dtype=np.int32)[:] = self.position_index.ravel()
+        self.positions = np.stack((xs, ys), axis=1)
+        self.n_states = len(ys) * self.n_velocities
+
+    def state_index(self, position, velocity):
+        # Flat index of the state (position, velocity), -1 if the position is not drivable
+        x, y = position
+        if y < 0 or x < 0 or y >= self.position_index.shape[0] or x >= self.position_index.shape[1]:
+            return -1
+        p = int(self.position_index[y, x])
+        if p < 0:
+            return -1
+        return p * self.n_velocities + (velocity[0] - self.min_speed_x) * self.n_velocities_y + \
+            velocity[1] - self.min_speed_y
+
+    def state_indices(self, x, y, vx, vy):
+        # Vectorized state_index over arrays of positions and velocities
+        height, width = self.position_index.shape
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        p = self.position_index[np.where(inside, y, 0), np.where(inside, x, 0)]
+        states = p * self.n_velocities + (vx - self.min_speed_x) * self.n_velocities_y + vy - self.min_speed_y
+        return np.where(inside & (p >= 0), states, -1)
+
+    def velocity_components(self):
+        # (vx, vy) of every velocity index
+        vx = np.repeat(np.arange(self.min_speed_x, self.max_speed_x + 1), self.n_velocities_y)
+        vy = np.tile(np.arange(self.min_speed_y, self.max_speed_y + 1), self.n_velocities // self.n_velocities_y)
+        return vx, vy
+
+    def compute_action_moves(self):
+        # Velocity index of velocity + action for every velocity index and action, -1 when the action is not
+        # possible: the new velocity is out of the speed limits or (0, 0). The same at every position: the move of
+        # the state p * n_velocities + v with action a is the state p * n_velocities + action_moves[v, a]
+        vel_x, vel_y = self.velocity_components()
+        actions = np.array(ACTIONS)
+        new_vx, new_vy = vel_x[:, None] + actions[:, 0], vel_y[:, None] + actions[:, 1]
+        possible = (new_vx >= self.min_speed_x) & (new_vx <= self.max_speed_x) & \
+                   (new_vy >= self.min_speed_y) & (new_vy <= self.max_speed_y) & ((new_vx != 0) | (new_vy != 0))
+        self.action_moves = np.where(possible,
+                                     (new_vx - self.min_speed_x) * self.n_velocities_y + new_vy - self.min_speed_y, -1)
+
+    def compute_transitions(self, chunk_size=1 << 20):
+        # The track is static: precompute the outcome of moving from every drivable position with every
+        # velocity (the velocity after the action), indexed like the states. Chunked to bound memory
+        vel_x, vel_y = self.velocity_components()
+        self.transitions = np.empty(self.n_states, dtype=np.uint8)
+        self.move_crashes = np.empty(self.n_states, dtype=bool)
+        for start in range(0, self.n_states, chunk_size):
+            states = np.arange(start, min(start + chunk_size, self.n_states))
+            p, v = np.divmod(states, self.n_velocities)
+            x0, y0, vx, vy = self.positions[p, 0], self.positions[p, 1], vel_x[v], vel_y[v]
+            finished = self.crossed_finish_line(x0, y0, x0 + vx, y0 + vy)
+            crashed = self.collision.crashes(x0, y0, vx, vy)
+            self.move_crashes[start:start + len(states)] = crashed
+            self.transitions[start:start + len(states)] = np.where(finished, FINISHED, np.where(crashed, CRASH, OK))
+        # Bytes for the scalar lookups (e.g. by Episode), the arrays are read-only views of them
+        self.transition_lookup = self.transitions.tobytes()
+        self.transitions = np.frombuffer(self.transition_lookup, dtype=np.uint8)
+        self._move_crashes = self.move_crashes.tobytes()
+        self.move_crashes = np.frombuffer(self._move_crashes, dtype=bool)
+
+    def move_outcome(self, position, velocity):
+        # Outcome of moving from a drivable position with the given velocity
+        return self.transitions[self.state_index(position, velocity)]
+
+    def move_outcomes(self, x0, y0, vx, vy):
+        # Vectorized has_finished / check_for_crash for moves from (x0, y0) with velocity (vx, vy).
+        # The finish line is checked first, as in the simulation loop
+        x1, y1 = x0 + vx, y0 + vy
+        finished = self.crossed_finish_line(x0, y0, x1, y1)
+        crashed = self.collision.crashes(x0, y0, vx, vy)
+        return np.where(finished, FINISHED, np.where(crashed, CRASH, OK)).astype(np.uint8)
+
+    def crossed_finish_line(self, x0, y0, x1, y1):
+        # Vectorized has_finished
+        (xa, ya), (xb, yb) = self.finish_line_endpoints
+        return closed_segment_intersect_batch(np.stack((x0, y0), axis=-1), np.stack((x1, y1), axis=-1),
+                                              np.array([xa, ya]), np.array([xb, yb]))
+
     def sort_start_line(self):
         self.start_positions.sort(key=lambda x: x[1])
 
@@ -31,25 +162,25 @@ class Racetrack:
         min_y = min([y for x, y in self.end_positions])
         x = self.end_positions[0][0]
         self.finish_line_endpoints = (x, min_y), (x, max_y)
+        self.finish_line = x, min_y, max_y
 
     def create_empty_grid(self):
-        self.grid = [[0 for _ in range(self.shape[1])] for _ in range(self.shape[0])]
+        self.grid = np.zeros(self.shape, dtype=np.uint8)
         # initialize an empty nxm grid
 
     def right_walk(self, x_start, min_space=5, min_width=5):
         random.seed(self.seed)
         # set 'padding' to the max velocity
-        n = len(self.grid)
-        m = len(self.grid[0])
+        n, m = self.grid.shape
         x = x_start
-        self.grid[n - 2][x] = 2
+        self.grid[n - 2, x] = 2
         # force to go U on the first step
         y = n - 2
         self.max_x = x - min_width - 1
 
         while x < m - min_width - 1:
             # leave space to account for velocity at finish line
-            self.grid[y][x] = 2
+            self.grid[y, x] = 2
             if y - min_space - min_width == 0:
                 # no space to go U anymore
                 x += 1
@@ -60,30 +191,29 @@ class Racetrack:
                     y -= 1
                 else:
                     x += 1
-        self.grid[y][x] = 3
+        self.grid[y, x] = 3
         self.end_positions.append((x, y))
         # we stop at the finish line
         self.max_height = y
 
     def left_walk(self, x_start, min_space=5, min_width=5):
         random.seed(self.seed)
-        n = len(self.grid)
-        m = len(self.grid[0])
+        n, m = self.grid.shape
         x = x_start
-        self.grid[n - 2][x] = 2
-        self.grid[n - 3][x] = 2
+        self.grid[n - 2, x] = 2
+        self.grid[n - 3, x] = 2
         # Force to go U on the first two steps
         y = n - 3
 
         while x < m - min_width - 1:
-            self.grid[y][x] = 2
+            self.grid[y, x] = 2
             if y - min_space == 0:
                 # no space to go U anymore
                 x += 1
             elif (y < self.max_height) & (self.max_height - y < 5):
                 # make sure the road is wide enough to turn
                 y -= 1
-            elif self.grid[y][x + min_width] == 2:
+            elif self.grid[y, x + min_width] == 2:
                 # make sure road is wide enough
                 y -= 1
             elif self.max_height - y > 2 * min_width:
@@ -96,13 +226,12 @@ class Racetrack:
                     y -= 1
                 else:
                     x += 1
-        self.grid[y][x] = 3
+        self.grid[y, x] = 3
         self.end_positions.append((x, y))
 
         # paint the finish line
-        for i in range(y, self.max_height):
-            self.grid[i][m - min_width - 1] = 3
-            self.end_positions.append((m - min_width - 1, i))
+        self.grid[y:self.max_height, m - min_width - 1] = 3
+        self.end_positions.extend((m - min_width - 1, i) for i in range(y, self.max_height))
 
     def draw_grid_edges(self, min_space=5, min_width=5):
         start_r = (min_space + min_width * 2 - 1)
@@ -111,17 +240,28 @@ class Racetrack:
         self.left_walk(start_l)
         for j in range(start_l, start_r + 1):
             self.start_positions.append((len(self.grid) - 1, j))
-            self.grid[len(self.grid) - 1][j] = 1
+        self.grid[len(self.grid) - 1, start_l:start_r + 1] = 1
 
         x_start_fill = start_l + 1
         self.fill_grid(len(self.grid) - 2, x_start_fill)
 
     def fill_grid(self, y, x):
-        # converts all the interior 0's to 2's
-        if self.grid[y][x] == 0:
-            self.grid[y][x] = 2
-            self.fill_grid(y, x + 1)
-            self.fill_grid(y - 1, x)
+        # converts all the interior 0's to 2's: the 0's reachable from (y, x) going right or up.
+        # Scanline fill, one vectorized pass per row from y upwards
+        outside = self.grid == 0
+        columns = np.arange(self.grid.shape[1])
+        seeds = np.zeros(self.grid.shape[1], dtype=bool)
+        seeds[x] = True
+        for row in range(y, -1, -1):
+            # 0's reached from the row below (or the starting cell)
+            seeds &= outside[row]
+            if not seeds.any():
+                break
+            # going right from a seed until the next non-0 cell
+            last_seed = np.maximum.accumulate(np.where(seeds, columns, -1))
+            last_wall = np.maximum.accumulate(np.where(outside[row], -1, columns))
+            seeds = outside[row] & (last_seed > last_wall)
+            self.grid[row, seeds] = 2
 
     def has_finished(self, position, velocity):
         # Compute whether the segments:
@@ -130,9 +270,8 @@ class Racetrack:
         # If they are, then the car has finished
         x, y = position
         vx, vy = velocity
-        x_prev = x - vx
-        y_prev = y - vy
-        return closed_segment_intersect((x_prev, y_prev), (x, y), *self.finish_line_endpoints)
+        # The finish line is vertical
+        return crosses_vertical_segment(x - vx, y - vy, x, y, *self.finish_line)
 
     def has_finished_old(self, position, velocity):
         # check if the car has reached the finish line
@@ -176,40 +315,51 @@ class Racetrack:
             return False
 
     def jumped_over_wall(self, position, velocity):
-        x1, y1 = position
-        vx, vy = velocity
-        if (y1, x1) in self.start_positions:
-            return False
-        x0 = x1 - vx
-        y0 = y1 - vy
-        for x, y in bresenham(x0, y0, x1, y1):
-            if y < len(self.grid) and x < len(self.grid[0]) and self.grid[y][x] == 0:
-                #print("jumped_over_wall: ", x, y, self.grid[y][x])
-                return True
-        return False
+        return self.collision.jumped_over_wall(position, velocity)
 
     def check_for_crash(self, position, velocity):
-        # check if the car will crash
+        # check if the car will crash: looked up in the precomputed moves for the velocities of the state space
         x, y = position
-        return self.grid[y][x] == 0 or self.jumped_over_wall(position, velocity)
-
-    def store_grid(self):
-        # get the current time to name the file
-        time = datetime.datetime.now()
-        filename = 'grid_'+str(time).replace('-', '_').split('.', 1)[0].replace(':', '_').replace(' ', 'h')+'.csv'
-        # store the grid in a file
-        with open('runs/'+filename, 'w') as f:
-            for x in self.grid:
-                for y in x:
-                    if y != '[' or y != ']':
-                        f.write(str(y)+',')
-                f.write('\n')
-        return filename
+        vx, vy = velocity
+        if self.min_speed_x <= vx <= self.max_speed_x and self.min_speed_y <= vy <= self.max_speed_y:
+            x0, y0 = x - vx, y - vy
+            height, width = self.position_index.shape
+            if 0 <= y0 < height and 0 <= x0 < width:
+                p = self.position_lookup[y0 * width + x0]
+                if p >= 0:
+                    return self._move_crashes[p * self.n_velocities + (vx - self.min_speed_x) * self.n_velocities_y +
+                                              vy - self.min_speed_y] == 1
+        return self.collision.crash(position, velocity)
+
+    def track_hash(self):
+        # The generated track only depends on the seed, the shape and the generator parameters
+        key = json.dumps({'seed': self.seed, 'grid_shape': list(self.shape), **GENERATOR_PARAMS}, sort_keys=True)
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def store_grid(self, path):
+        # store the grid and the generator outputs the track relies on; written to a temporary file first
+        # so that concurrent runs never read a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            version, internal_state, gauss_next = random.getstate()
+            np.savez(f, grid=self.grid, start_positions=np.array(self.start_positions),
+                     end_positions=np.array(self.end_positions), max_height=self.max_height, max_x=self.max_x,
+                     random_state=np.array(internal_state, dtype=np.uint32))
+        os.replace(tmp_path, path)
+
+    def load_grid(self, path):
+        with np.load(path) as data:
+            self.grid = data['grid']
+            self.start_positions = [tuple(p) for p in data['start_positions'].tolist()]
+            self.end_positions = [tuple(p) for p in data['end_positions'].tolist()]
+            self.max_height = int(data['max_height'])
+            self.max_x = int(data['max_x'])
+            random.setstate((3, tuple(data['random_state'].tolist()), None))
 
     def print(self):
-        values_map = {0: u"█", 1: "X", 2: " ", 3: "X"}
-        for i in range(len(self.grid)):
-            print(''.join([values_map[self.grid[i][j]] for j in range(len(self.grid[i]))]))
+        values_map = np.array([u"█", "X", " ", "X"])
+        for row in values_map[self.grid]:
+            print(''.join(row))
 
 
 #
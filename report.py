@@ -0,0 +1,88 @@
+from racetrack import Racetrack
+from rl_racetrack import RLRacetrack, REPORT_FIGURES
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import subprocess
+import sys
+import yaml
+
+# Report figures rendered to image files from the artifacts of runs saved by train.py, in worker processes.
+# matplotlib is only imported by the workers, with a non-interactive backend: nothing is ever shown
+
+
+def use_file_backend():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def load_run(run_dir):
+    # RLRacetrack with the track, the state values and the statistics of a saved run, resumed from the final
+    # checkpoint in the checkpoint_dir of its configuration
+    with open(os.path.join(run_dir, 'config.yaml')) as f:
+        config = yaml.safe_load(f)
+    track = Racetrack(config)
+    track.create_grid(run_dir)
+    rl_racetrack = RLRacetrack(dict(config, warm_start=None), track)
+    rl_racetrack.resume(config.get('checkpoint_dir') or os.path.join(run_dir, 'checkpoint'))
+    return rl_racetrack
+
+
+def load_summary(run_dir):
+    with open(os.path.join(run_dir, 'summary.json')) as f:
+        return json.load(f)
+
+
+def render_figure(run_dir, figure, filename):
+    # The path of the learnt policy is not logged: the workers would all write the same file
+    load_run(run_dir).report_figure(figure, filename, policy_log=None)
+    return filename
+
+
+def render_sweep(run_dirs, filename):
+    # Convergence curves of the runs in one figure, named after their run directories
+    from multiple_rl import plot_curves
+
+    summaries = {os.path.basename(os.path.normpath(run_dir)): load_summary(run_dir) for run_dir in run_dirs}
+    curves = {name: (summary['curve']['episodes'], summary['curve']['moving_average'])
+              for name, summary in summaries.items()}
+    plot_curves(curves, next(iter(summaries.values()))['window'], filename)
+    return filename
+
+
+def render_reports(run_dirs, sweep_file=None, n_workers=None):
+    # Render every figure of every run to <run_dir>/report/<figure>.png in parallel, and the comparison of the
+    # runs to sweep_file (if set). Returns the image files
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=use_file_backend) as executor:
+        futures = []
+        for run_dir in run_dirs:
+            os.makedirs(os.path.join(run_dir, 'report'), exist_ok=True)
+            futures += [executor.submit(render_figure, run_dir, figure,
+                                        os.path.join(run_dir, 'report', f'{figure}.png'))
+                        for figure in REPORT_FIGURES]
+        if sweep_file is not None:
+            futures.append(executor.submit(render_sweep, run_dirs, sweep_file))
+        return [future.result() for future in futures]
+
+
+def start_report(run_dirs, sweep_file=None, n_workers=None):
+    # Run render_reports in a separate process, without waiting for it: returns the process (subprocess.Popen)
+    command = [sys.executable, os.path.abspath(__file__), *run_dirs]
+    if sweep_file is not None:
+        command += ['--sweep', sweep_file]
+    if n_workers is not None:
+        command += ['--workers', str(n_workers)]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the report figures of saved runs (see train.py)')
+    parser.add_argument('run_dirs', nargs='+', help='run directories')
+    parser.add_argument('--sweep', help='image file comparing the convergence curves of the runs')
+    parser.add_argument('--workers', type=int, help='number of rendering processes')
+    args = parser.parse_args()
+
+    for filename in render_reports(args.run_dirs, args.sweep, args.workers):
+        print(filename)
@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+
+# On-disk results of sweep executions: one JSON record per configuration, named after the hash of the full
+# configuration. Records are written to a temporary file first: a record exists only once its execution completed
+
+
+def config_hash(config):
+    key = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def result_record(config, stats, runtime, stop_reason, profile=None, run_dir=None):
+    # Compact record of an execution: the returns are summarized by their RunningStats, with the downsampled curve.
+    # run_dir: directory of the run artifacts (see train.train), e.g. for report.py
+    episodes, moving_average = stats.curve()
+    last_average = stats.last_window_average()
+    return {
+        'config': config,
+        'episodes': stats.count,
+        'average_return': stats.mean,
+        'return_std': float(stats.std),
+        'last_window_average': last_average,
+        'window': stats.window,
+        'curve': {'episodes': episodes.tolist(), 'moving_average': [float(v) for v in moving_average]},
+        'runtime': runtime,
+        'stop_reason': stop_reason,
+        'profile': profile,
+        'run_dir': run_dir,
+    }
+
+
+class ResultStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, config):
+        return os.path.join(self.directory, f'{config_hash(config)}.json')
+
+    def __contains__(self, config):
+        return os.path.exists(self.path(config))
+
+    def save(self, record):
+        path = self.path(record['config'])
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def load(self, config):
+        with open(self.path(config)) as f:
+            return json.load(f)
+
+    def records(self, configs):
+        # Records of the configurations, read one at a time
+        for config in configs:
+            yield self.load(config)
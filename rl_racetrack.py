@@ -1,13 +1,26 @@
+from actor_learner import init_actor, generate_episodes
+from batch_episode import BatchEpisode
+from checkpoint import load_checkpoint, save_checkpoint
 from episode import Episode
+from episode_log import open_episode_log
+from profiler import Profiler
 from racetrack import Racetrack
+from state_values import StateValues
 
-from typing import List, Tuple
+from typing import List, Tuple, Union
 
-import seaborn as sns
+from multiprocessing import Pool
+import random
 import numpy as np
-import matplotlib.pyplot as plt
+import os
 import time
-from utils import mov_avg
+from stats import RunningStats
+from utils import show_or_save
+
+# Figures of the report, see RLRacetrack.report_figure
+REPORT_FIGURES = ['values_sum', 'values_max', 'policy_path', 'convergence']
+# File the path of the learnt policy is logged to by default, see RLRacetrack.policy_path_grid
+POLICY_LOG = r'runs\policy_path.csv'
 
 
 class RLRacetrack:
@@ -25,138 +38,381 @@ class RLRacetrack:
         self.min_speed_x = config['min_speed_x']
         self.min_speed_y = config['min_speed_y']
         self.max_episode_length = config['max_episode_length']
+        # Episode log format: 'csv' (text) or 'binary' (see episode_log)
+        self.log_format = config.get('log_format', 'csv')
+        # Episodes kept in the log (see episode_log.LOG_LEVELS) and the k of 'every' / N of 'first_last'.
+        # The log is written by a background thread unless log_background is false
+        self.log_level = config.get('log_level', 'full')
+        self.log_sample = config.get('log_sample', 100)
+        self.log_background = config.get('log_background', True)
+        # Number of episodes simulated in lockstep by BatchEpisode, 1 to simulate them one by one with Episode
+        self.batch_size = config.get('batch_size', 1)
+        self.rng = np.random.default_rng(config['seed'])
+        # Actor processes generating episodes for the learner (this process), see run_parallel.
+        # Actors get a fresh snapshot of the state values every sync_interval episodes
+        self.n_workers = config.get('n_workers', 1)
+        self.sync_interval = config.get('sync_interval', 100)
+        self.seed = config['seed']
+        self.actor_rngs = None
+        self._simulator = None  # see episode_simulator
+        # Training state saved every checkpoint_interval episodes in checkpoint_dir (if set), see resume
+        self.checkpoint_dir = config.get('checkpoint_dir')
+        self.checkpoint_interval = config.get('checkpoint_interval', 1000)
+        self.episode = 0  # number of episodes run
+        self._last_checkpoint = 0
+        # Stopping criteria besides the number of episodes (disabled when not set): the moving average of the returns
+        # has not improved by more than plateau_tolerance for plateau_patience episodes, the run has lasted
+        # max_wall_time seconds, or max_total_steps path entries have been simulated. Checked between batches
+        # (or actor rounds), see should_stop
+        self.plateau_tolerance = config.get('plateau_tolerance')
+        self.plateau_patience = config.get('plateau_patience', 1000)
+        self.max_wall_time = config.get('max_wall_time')
+        self.max_total_steps = config.get('max_total_steps')
+        self.total_steps = 0  # number of path entries simulated
+        self._best_average = -np.inf
+        self._best_episode = 0
+        self.stop_reason = None  # 'episodes', 'plateau', 'wall_time' or 'total_steps' once run
+        # Timers of the phases of the run and episode counters, saved next to the episode log (see run).
+        # None when profiling is disabled
+        self.profiler = Profiler() if config.get('profile', False) else None
+        if self.profiler is not None:
+            self.profiler.instrument(self, 'update_state_values', 'value_update')
+            self.profiler.instrument(self, 'save_checkpoint', 'checkpoint')
 
         self.map_racetrack_values = {0: 'outside', 1: 'start', 2: 'inside', 3: 'finish'}
 
         assert self.update_state_values_rule in ['first_visit', 'every_visit', 'last_visit', 'last_visit_best'], \
             'Invalid update state values rule'
-        self.episode_returns = []
+        self.stats = RunningStats(window=100)  # statistics of the episode returns
         self.start_time = time.time()
 
         self.state_values = self.define_state_values()  # (pos, vel) -> (estimated return, count)
+        if config.get('warm_start'):
+            self.warm_start(config['warm_start'])
 
     def define_state_values(self):
-        # Define the state values for all possible states
-        # (position, velocity) -> (estimated return, count)
-
-        possible_velocities = {(vx, vy) for vx in range(self.min_speed_x, self.max_speed_x + 1)
-                               for vy in range(self.min_speed_y, self.max_speed_y + 1)}
-        possible_positions = {(x, y) for x in range(len(self.racetrack.grid)) for y in
-                              range(len(self.racetrack.grid))}
-
-        state_values = {(pos, vel): (-self.inf, 0) for pos in possible_positions for vel in possible_velocities}
-
-        return state_values
+        # Define the state values for all drivable states
+        # (position, velocity) -> (estimated return, count), stored as dense arrays
+        return StateValues(self.racetrack, -self.inf)
 
     def run(self, filename):
         # create log file
         # print('Running episode simulations...')
-        f = open(filename, 'w')
-
-        for episode in range(self.n_episodes):
-            # print progress in percents.
-            if episode % (self.n_episodes // 10) == 0:
-                print(f'{episode // (self.n_episodes // 10) * 10}%')
-            f.write(f'Episode {episode + 1}\n')
-            ep = Episode(self.racetrack, self.epsilon, self.state_values,
-                         self.min_speed_x, self.max_speed_x, self.min_speed_y, self.max_speed_y, self.delta,
-                         self.max_episode_length)
-            path, reached_end = ep.simulate(f)
-            ep_return = self.update_state_values(path) if reached_end else - self.inf
-            self.episode_returns.append(ep_return)
-
-    def update_state_values(self, path: List[Tuple[Tuple[int, int], Tuple[int, int], int]]):
+        # After resume, runs the remaining episodes and logs them to filename
+        log = open_episode_log(filename, self.log_format, self.log_level, self.log_sample, self.log_background)
+        if self.profiler is not None:
+            self.profiler.instrument(log, 'write_episode', 'log_writing')
+        self._run_start = time.time()
+        self.stop_reason = None
+        if self.n_workers > 1:
+            self.run_parallel(log)
+        elif self.batch_size > 1:
+            self.run_batches(log)
+        else:
+            ep = self.episode_simulator()
+            if self.profiler is None:
+                simulate = ep.simulate
+            else:
+                # Per-phase timers of the episodes (see Episode.simulate) besides the whole simulation
+                timers = self.profiler.timers
+                simulate = self.profiler.timed(lambda: ep.simulate(timers=timers), 'simulate')
+            while not self.should_stop():
+                # print progress in percents.
+                if self.episode % (self.n_episodes // 10) == 0:
+                    print(f'{self.episode // (self.n_episodes // 10) * 10}%')
+                path, reached_end = simulate()
+                self.record_episode(log, path, reached_end)
+                self.checkpoint_if_due()
+        log.close()
+        if self.checkpoint_dir is not None:
+            self.save_checkpoint()
+        if self.profiler is not None:
+            self.profiler.timers['run'] += time.time() - self._run_start
+            self.profiler.save(f'{os.path.splitext(filename)[0]}_profile.json')
+
+    def episode_simulator(self):
+        # Episode simulating the episodes of the sequential runs, with the random numbers of rng
+        if self._simulator is None:
+            self._simulator = Episode(self.racetrack, self.epsilon, self.state_values,
+                                      self.min_speed_x, self.max_speed_x, self.min_speed_y, self.max_speed_y,
+                                      self.delta, self.max_episode_length, rng=self.rng)
+        return self._simulator
+
+    def should_stop(self):
+        # Whether the run is over, the reason is kept in stop_reason
+        if self.episode >= self.n_episodes:
+            self.stop_reason = 'episodes'
+        elif self.plateau_tolerance is not None and self.episode - self._best_episode >= self.plateau_patience:
+            self.stop_reason = 'plateau'
+        elif self.max_wall_time is not None and time.time() - self._run_start >= self.max_wall_time:
+            self.stop_reason = 'wall_time'
+        elif self.max_total_steps is not None and self.total_steps >= self.max_total_steps:
+            self.stop_reason = 'total_steps'
+        return self.stop_reason is not None
+
+    def print_progress(self, episode, progress):
+        # Print the progress in percents up to the given episode, returns the number of tenths printed
+        while episode >= progress * (self.n_episodes // 10) and progress < 10:
+            print(f'{progress * 10}%')
+            progress += 1
+        return progress
+
+    def record_episode(self, log, path, reached_end):
+        # Log a simulated path (array form) and learn from it
+        log.write_episode(self.episode + 1, path)
+        ep_return = self.update_state_values(path) if reached_end else - self.inf
+        if self.profiler is not None:
+            self.profiler.record_episode(self.racetrack, path, reached_end)
+        self.stats.add(ep_return)
+        self.episode += 1
+        self.total_steps += len(path)
+        # Plateau: the patience counts from the last improvement of the moving average, once the window is full
+        last_average = self.stats.last_window_average()
+        if last_average is None or last_average > self._best_average + (self.plateau_tolerance or 0):
+            self._best_average = -np.inf if last_average is None else last_average
+            self._best_episode = self.episode
+
+    def run_batches(self, log):
+        # Same as run, but episodes are simulated batch_size at a time with the state values of the batch start
+        progress = self.print_progress(self.episode, 0)
+        while not self.should_stop():
+            progress = self.print_progress(self.episode, progress)
+            batch = BatchEpisode(self.racetrack, self.epsilon, self.state_values,
+                                 self.min_speed_x, self.max_speed_x, self.min_speed_y, self.max_speed_y, self.delta,
+                                 self.max_episode_length, self.rng)
+            if self.profiler is not None:
+                self.profiler.instrument(batch, 'simulate', 'simulate')
+            paths, reached_end = batch.simulate(min(self.batch_size, self.n_episodes - self.episode))
+            for i, path in enumerate(paths):
+                self.record_episode(log, path, reached_end[i])
+            self.checkpoint_if_due()
+
+    def run_parallel(self, log):
+        # Actor/learner training: n_workers actor processes simulate up to sync_interval episodes each with a
+        # snapshot of the state values, then this process merges their paths in worker order with the update rule
+        # and sends the refreshed values. Every actor has its own random stream derived from the seed, so that a run
+        # is reproducible for a given number of workers
+        settings = dict(epsilon=self.epsilon, min_speed_x=self.min_speed_x, max_speed_x=self.max_speed_x,
+                        min_speed_y=self.min_speed_y, max_speed_y=self.max_speed_y, delta=self.delta,
+                        max_episode_length=self.max_episode_length)
+        if self.actor_rngs is None:
+            self.actor_rngs = [np.random.default_rng(s)
+                               for s in np.random.SeedSequence(self.seed).spawn(self.n_workers)]
+        rngs = self.actor_rngs
+        progress = self.print_progress(self.episode, 0)
+        with Pool(self.n_workers, initializer=init_actor, initargs=(self.racetrack, settings)) as pool:
+            while not self.should_stop():
+                progress = self.print_progress(self.episode, progress)
+                remaining = self.n_episodes - self.episode
+                sizes = [min(self.sync_interval, remaining - w * self.sync_interval) for w in range(self.n_workers)]
+                # Tasks are pickled in the background: send a copy that the merge below cannot modify
+                snapshot = self.state_values.values.copy(), self.state_values.counts.copy()
+                tasks = [(w, pool.apply_async(generate_episodes, (*snapshot, rngs[w], size)))
+                         for w, size in enumerate(sizes) if size > 0]
+                for w, task in tasks:
+                    wait_start = time.time()
+                    paths, reached_end, rngs[w] = task.get()
+                    if self.profiler is not None:
+                        self.profiler.timers['actor_wait'] += time.time() - wait_start
+                    for i, path in enumerate(paths):
+                        self.record_episode(log, path, reached_end[i])
+                self.checkpoint_if_due()
+
+    def checkpoint_if_due(self):
+        # Checkpoints are only taken between batches (or actor rounds), where a resumed run continues identically
+        if self.checkpoint_dir is not None and \
+                self.episode // self.checkpoint_interval > self._last_checkpoint // self.checkpoint_interval:
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        state = {
+            'episode': self.episode,
+            'track': self.racetrack.track_hash(),
+            'n_states': self.racetrack.n_states,
+            'random_state': list(random.getstate()[1]),
+            'rng_state': self.rng.bit_generator.state,
+            'simulator_random_state': None if self._simulator is None else self._simulator.get_random_state(),
+            'actor_rng_states': None if self.actor_rngs is None else
+            [rng.bit_generator.state for rng in self.actor_rngs],
+            'stats': self.stats.get_state(),
+            'total_steps': self.total_steps,
+            'best_average': self._best_average,
+            'best_episode': self._best_episode,
+        }
+        save_checkpoint(self.checkpoint_dir, f'episode_{self.episode}', self.state_values.values,
+                        self.state_values.counts, state)
+        self._last_checkpoint = self.episode
+
+    def load_state_values(self, checkpoint_dir):
+        # Memory-mapped values and counts of a checkpoint of a run on the same track
+        values, counts, state = load_checkpoint(checkpoint_dir)
+        if state['track'] != self.racetrack.track_hash() or state['n_states'] != self.racetrack.n_states:
+            raise ValueError(f'The checkpoint in {checkpoint_dir} is not from a run on this track')
+        self.state_values.assign(values, counts)
+        return state
+
+    def warm_start(self, checkpoint_dir):
+        # Start from the state values of a previous run on the same track, statistics and episodes start from 0
+        self.load_state_values(checkpoint_dir)
+
+    def resume(self, checkpoint_dir):
+        # Restore the training state of the last checkpoint: the next run continues exactly as the
+        # checkpointed run would have (same configuration and number of workers)
+        state = self.load_state_values(checkpoint_dir)
+        self.episode = self._last_checkpoint = state['episode']
+        random.setstate((3, tuple(state['random_state']), None))
+        self.rng.bit_generator.state = state['rng_state']
+        if state['simulator_random_state'] is not None:
+            self.episode_simulator().set_random_state(state['simulator_random_state'])
+        if state['actor_rng_states'] is not None:
+            self.actor_rngs = []
+            for rng_state in state['actor_rng_states']:
+                rng = np.random.default_rng()
+                rng.bit_generator.state = rng_state
+                self.actor_rngs.append(rng)
+        self.stats.set_state(state['stats'])
+        self.total_steps = state['total_steps']
+        self._best_average, self._best_episode = state['best_average'], state['best_episode']
+
+    def update_state_values(self, path: Union[List[Tuple[Tuple[int, int], Tuple[int, int], int]], np.ndarray]):
+        # path: list of (position, velocity, action) or array of rows (x, y, vx, vy, action index)
+        # Positions outside the track (crashes, crossing the finish line) have no state value,
+        # they only contribute to the return
+        if isinstance(path, np.ndarray):
+            states = self.racetrack.state_indices(path[:, 0], path[:, 1], path[:, 2], path[:, 3]).tolist()
+        else:
+            states = [self.racetrack.state_index(pos, vel) for pos, vel, _ in path]
+        values, counts = self.state_values.values, self.state_values.counts
         g = 0
         visited = set()
         if self.update_state_values_rule in ['last_visit', 'last_visit_best']:
-            for pos, vel, _ in reversed(path):
+            for s in reversed(states):
                 g += self.timestep_reward
-                if (pos, vel) not in visited:
-                    estimated_return, count = self.state_values[pos, vel]
+                if s >= 0 and s not in visited:
+                    estimated_return, count = values[s], counts[s]
                     if self.update_state_values_rule == 'last_visit_best':
-                        self.state_values[pos, vel] = (max(estimated_return, g), count + 1)
+                        values[s] = max(estimated_return, g)
                     else:
-                        self.state_values[pos, vel] = \
-                            ((count * estimated_return + g) / (count + 1), count + 1) if count > 0 else (g, 1)
-                    visited.add((pos, vel))
+                        values[s] = (count * estimated_return + g) / (count + 1) if count > 0 else g
+                    counts[s] = count + 1
+                    visited.add(s)
 
         else:
-            for pos, vel, _ in path:
+            for s in states:
                 g += self.timestep_reward
-                if self.update_state_values_rule == 'every_visit' or \
-                        (self.update_state_values_rule == 'first_visit' and (pos, vel) not in visited):
-                    estimated_return, count = self.state_values[pos, vel]
-                    self.state_values[pos, vel] = \
-                        ((count * estimated_return + g) / (count + 1), count + 1) if count > 0 else (g, 1)
-                    visited.add((pos, vel))
+                if s >= 0 and (self.update_state_values_rule == 'every_visit' or
+                               (self.update_state_values_rule == 'first_visit' and s not in visited)):
+                    estimated_return, count = values[s], counts[s]
+                    values[s] = (count * estimated_return + g) / (count + 1) if count > 0 else g
+                    counts[s] = count + 1
+                    visited.add(s)
+        self.state_values.refresh_greedy(np.fromiter(visited, dtype=np.int64, count=len(visited)))
         return g
 
-    def report(self):
+    def report(self, directory=None):
         # 1. Plot the state values map (project into position space)
         # 2. Plot the convergence curve: return vs iteration
         # 3. Plot path following learnt policy (use follow_policy method)
+        # With directory, the figures are saved there as <figure>.png instead of shown
         self.print_stats()
 
-        base_grid = np.array(self.racetrack.grid).astype('float')
-        self.state_values_map(base_grid, how='sum')
-        self.state_values_map(base_grid, how='max')
-        self.learnt_policy_path(base_grid)
-        self.convergence_curve()
+        for figure in REPORT_FIGURES:
+            self.report_figure(figure, None if directory is None else os.path.join(directory, f'{figure}.png'))
+
+    def report_figure(self, figure, filename=None, policy_log=POLICY_LOG):
+        # Show one of REPORT_FIGURES, or save it to filename. policy_log: see policy_path_grid
+        if figure == 'values_sum':
+            self.state_values_map(how='sum', filename=filename)
+        elif figure == 'values_max':
+            self.state_values_map(how='max', filename=filename)
+        elif figure == 'policy_path':
+            self.learnt_policy_path(filename=filename, policy_log=policy_log)
+        elif figure == 'convergence':
+            self.convergence_curve(filename=filename)
+        else:
+            raise ValueError(f'Unknown figure {figure}')
 
     def print_stats(self):
         print('\n-- Execution stats --')
-        print('Number of episodes:', self.n_episodes)
-        print('Average return:', np.mean(self.episode_returns))
-        print('Last 100 episodes average return:',
-              np.mean(self.episode_returns[-100:] if len(self.episode_returns) >= 100 else 'N/A'))
+        print('Number of episodes:', self.stats.count)
+        print('Stopped by:', self.stop_reason)
+        print('Total steps:', self.total_steps)
+        print('Average return:', self.stats.mean)
+        print('Return standard deviation:', self.stats.std)
+        last_average = self.stats.last_window_average()
+        print(f'Last {self.stats.window} episodes average return:', 'N/A' if last_average is None else last_average)
         print('Total runtime:', round(time.time() - self.start_time, 2), 'seconds')
 
-    def state_values_map(self, base_grid: np.ndarray, how='sum'):
-        # Plot the state values map (project into position space)
-        # Use seaborn heatmap
-        grid = base_grid.copy()
+    def summary(self):
+        # JSON-serializable results of the run: the statistics printed by print_stats and the convergence curve
+        episodes, moving_average = self.stats.curve()
+        return {
+            'episodes': self.stats.count,
+            'stop_reason': self.stop_reason,
+            'total_steps': self.total_steps,
+            'average_return': self.stats.mean,
+            'return_std': self.stats.std,
+            'last_window_average': self.stats.last_window_average(),
+            'window': self.stats.window,
+            'runtime': time.time() - self.start_time,
+            'track': self.racetrack.track_hash(),
+            'curve': {'episodes': episodes.tolist(), 'moving_average': moving_average.tolist()},
+        }
 
-        cmap = {'outside': np.nan}
-        for i in range(len(grid)):
-            for j in range(len(grid[i])):
-                grid[i][j] = cmap.get(self.map_racetrack_values[base_grid[i][j]], -self.inf)
-                if grid[i][j] < 0:
-                    proj_func = max if how == 'max' else sum
-                    state_values = [self.state_values[(j, i), (vx, vy)][0] for vx in
-                                    range(self.min_speed_x, self.max_speed_x + 1)
-                                    for vy in range(self.min_speed_y, self.max_speed_y + 1)]
+    def state_values_projection(self, how='sum'):
+        # State values projected into position space (NaN outside the track):
+        # 'sum', 'max' or 'mean' over the velocities, or 'visits' for the number of updates
+        return self.state_values.project(how)
 
-                    grid[i][j] = proj_func(state_values)
+    def state_values_map(self, how='sum', filename=None):
+        # Plot the state values map (project into position space)
+        # Use seaborn heatmap
+        import seaborn as sns  # plotting libraries are only imported by the reports
 
+        grid = self.state_values_projection(how)
         sns.heatmap(grid, annot=False, fmt=".1f").set(title=f'State values map - {how} projection')
-        plt.show()
+        show_or_save(filename)
 
-    def convergence_curve(self):
+    def convergence_curve(self, filename=None):
         # Plot the convergence curve: return vs iteration
         # For smoothing purposes, we actually plot return vs 100-episode moving average of returns
-        smoothing_ma_window = 100
-        moving_average = mov_avg(self.episode_returns, smoothing_ma_window)
-        sns.lineplot(x=range(self.n_episodes), y=moving_average). \
+        # (downsampled on long runs, see RunningStats)
+        import seaborn as sns
+
+        smoothing_ma_window = self.stats.window
+        episodes, moving_average = self.stats.curve()
+        sns.lineplot(x=episodes, y=moving_average). \
             set(xlabel='Episode', ylabel='Return', title=f'Convergence curve (MA = {smoothing_ma_window})')
-        plt.show()
+        show_or_save(filename)
+
+    def policy_path_grid(self, state_values: StateValues = None, policy_log=POLICY_LOG):
+        # Run the learnt policy from the middle of the start line: grid shaped array with the path cells set to 1,
+        # the start and finish lines to inf, the other track cells to -inf and NaN outside the track.
+        # state_values replaces the learnt values, e.g. with ValueIteration.state_values(). The path is logged to
+        # the policy_log file, not logged when None
+        state_values = self.state_values if state_values is None else state_values
+        ep = Episode(self.racetrack, 0, state_values, self.min_speed_x, self.max_speed_x, self.min_speed_y,
+                     self.max_speed_y, 0, self.max_episode_length, random_start=False,
+                     rng=np.random.default_rng(self.seed))
+        if policy_log is None:
+            path, _ = ep.simulate()
+        else:
+            f = open(policy_log, 'w')
+            f.write('Episode 0:\n')
+            path, _ = ep.simulate(f)
+            f.close()
 
-    def learnt_policy_path(self, base_grid: np.ndarray):
+        # outside, start, inside, finish
+        grid = np.array([np.nan, self.inf, -self.inf, self.inf])[self.racetrack.grid]
+
+        xs, ys = path[:, 0], path[:, 1]
+        on_grid = (xs >= 0) & (xs < grid.shape[1]) & (ys >= 0) & (ys < grid.shape[0])
+        grid[ys[on_grid], xs[on_grid]] = 1
+        return grid
+
+    def learnt_policy_path(self, state_values: StateValues = None, filename=None, policy_log=POLICY_LOG):
         # Plot path following learnt policy
-        # Run the policy and print the path
-        ep = Episode(self.racetrack, 0, self.state_values, self.min_speed_x, self.max_speed_x, self.min_speed_y,
-                     self.max_speed_y, 0, self.max_episode_length, random_start=False)
-        f = open(r'runs\policy_path.csv', 'w')
-        f.write('Episode 0:\n')
-        path, _ = ep.simulate(f)
-
-        grid = base_grid.copy()
-        cmap = {'outside': np.nan, 'start': self.inf, 'finish': self.inf, 'inside': -self.inf}
-
-        for i in range(len(grid)):
-            for j in range(len(grid[i])):
-                grid[i][j] = cmap[self.map_racetrack_values[base_grid[i][j]]]
-
-        for pos, _, _ in path:
-            grid[pos[1]][pos[0]] = 1
-        sns.heatmap(grid, annot=False, fmt=".1f").set(title='Path following learnt policy')
-        plt.show()
+        import seaborn as sns
+
+        sns.heatmap(self.policy_path_grid(state_values, policy_log), annot=False, fmt=".1f").set(title='Path following learnt policy')
+        show_or_save(filename)
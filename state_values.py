@@ -0,0 +1,82 @@
+from racetrack import Racetrack, ACTIONS
+
+import numpy as np
+
+
+class StateValues:
+    def __init__(self, racetrack: Racetrack, initial_value):
+        # Dense table over the drivable states of the racetrack, indexed by Racetrack.state_index
+        # values: estimated return, counts: number of updates of the estimate
+        self.racetrack = racetrack
+        self.values = np.full(racetrack.n_states, initial_value, dtype=np.float64)
+        self.counts = np.zeros(racetrack.n_states, dtype=np.int64)
+        # greedy: index in ACTIONS of the possible action of every state whose move (see Racetrack.action_moves) has
+        # the best (estimated return, count), -1 when several are tied. All tied in the initial table
+        self.greedy = np.full(racetrack.n_states, -1, dtype=np.int8)
+
+    def assign(self, values, counts):
+        # Replace the table, e.g. with a snapshot received from another process
+        self.values = values
+        self.counts = counts
+        self.refresh_greedy()
+
+    def refresh_greedy(self, changed=None):
+        # Recompute the greedy actions of the states that can move to the changed entries (indices), of all the
+        # states by default. A move only changes the velocity: the states are at the same position
+        if changed is None:
+            states = np.arange(self.racetrack.n_states)
+        else:
+            n_velocities, n_velocities_y = self.racetrack.n_velocities, self.racetrack.n_velocities_y
+            p, v = np.divmod(np.asarray(changed, dtype=np.int64), n_velocities)
+            vx, vy = np.divmod(v, n_velocities_y)
+            actions = np.array(ACTIONS)
+            # Velocity components relative to the minimum speeds, before the action
+            vx, vy = vx[:, None] - actions[:, 0], vy[:, None] - actions[:, 1]
+            inside = (vx >= 0) & (vx < n_velocities // n_velocities_y) & (vy >= 0) & (vy < n_velocities_y)
+            states = np.unique((p[:, None] * n_velocities + vx * n_velocities_y + vy)[inside])
+
+        n_velocities = self.racetrack.n_velocities
+        p, v = np.divmod(states, n_velocities)
+        velocity_moves = self.racetrack.action_moves[v]
+        possible = velocity_moves >= 0
+        moves = p[:, None] * n_velocities + np.maximum(velocity_moves, 0)
+        values = np.where(possible, self.values[moves], -np.inf)
+        counts = np.where(possible, self.counts[moves], -1)
+        best = values == values.max(axis=1, keepdims=True)
+        counts = np.where(best, counts, -1)
+        best &= counts == counts.max(axis=1, keepdims=True)
+        self.greedy[states] = np.where(best.sum(axis=1) == 1, best.argmax(axis=1), -1)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, state):
+        # (position, velocity) -> (estimated return, count); tuples compare by return, then by count
+        s = self.racetrack.state_index(*state)
+        return self.values[s], self.counts[s]
+
+    def index(self, position, velocity):
+        return self.racetrack.state_index(position, velocity)
+
+    def value(self, position, velocity):
+        # Estimated return of a drivable state
+        return self.values[self.racetrack.state_index(position, velocity)]
+
+    def project(self, how='sum'):
+        # Project the table into position space, as a grid shaped array (NaN outside the track):
+        # 'sum', 'max' or 'mean' of the values over the velocities, or 'visits' (total count of updates)
+        table = (self.counts if how == 'visits' else self.values).reshape(-1, self.racetrack.n_velocities)
+        reductions = {'sum': np.sum, 'max': np.max, 'mean': np.mean, 'visits': np.sum}
+        if how not in reductions:
+            raise ValueError(f'Unknown projection {how}')
+        projected = reductions[how](table, axis=1)
+
+        index = self.racetrack.position_index
+        return np.where(index >= 0, projected[np.maximum(index, 0)], np.nan)
+
+    def velocity_values(self, position):
+        # Estimated returns of all the velocities at a drivable position, shape (n_vx, n_vy)
+        x, y = position
+        p = self.racetrack.position_index[y, x]
+        n = self.racetrack.n_velocities
+        return self.values[p * n:(p + 1) * n].reshape(-1, self.racetrack.n_velocities_y)
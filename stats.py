@@ -0,0 +1,78 @@
+from collections import deque
+
+import numpy as np
+
+
+class RunningStats:
+    def __init__(self, window=100, max_points=1000):
+        # Statistics of the episode returns with bounded memory, updated one return at a time:
+        # running mean and variance (Welford), moving average over the last window returns, and the moving average
+        # curve downsampled to at most max_points points
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+        self.window = window
+        self._window_values = deque(maxlen=window)
+        self._window_sum = 0.0
+
+        # The curve keeps the moving average of every stride-th episode, stride doubles when it is full
+        self.max_points = max_points
+        self.stride = 1
+        self._curve_episodes = []
+        self._curve_values = []
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+
+        if len(self._window_values) == self.window:
+            self._window_sum -= self._window_values[0]
+        self._window_values.append(x)
+        self._window_sum += x
+
+        episode = self.count - 1
+        if episode % self.stride == 0:
+            self._curve_episodes.append(episode)
+            self._curve_values.append(self.moving_average())
+            if len(self._curve_episodes) > self.max_points:
+                self._curve_episodes = self._curve_episodes[::2]
+                self._curve_values = self._curve_values[::2]
+                self.stride *= 2
+
+    def get_state(self):
+        # JSON-serializable state, see set_state
+        return {'count': self.count, 'mean': self.mean, 'm2': self._m2, 'window': self.window,
+                'window_values': list(self._window_values), 'window_sum': self._window_sum,
+                'max_points': self.max_points, 'stride': self.stride,
+                'curve_episodes': self._curve_episodes, 'curve_values': self._curve_values}
+
+    def set_state(self, state):
+        self.count, self.mean, self._m2 = state['count'], state['mean'], state['m2']
+        self.window = state['window']
+        self._window_values = deque(state['window_values'], maxlen=self.window)
+        self._window_sum = state['window_sum']
+        self.max_points, self.stride = state['max_points'], state['stride']
+        self._curve_episodes, self._curve_values = list(state['curve_episodes']), list(state['curve_values'])
+
+    @property
+    def variance(self):
+        return self._m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def moving_average(self):
+        # Average of the last window returns (of all of them while there are fewer)
+        return self._window_sum / len(self._window_values) if self._window_values else np.nan
+
+    def last_window_average(self):
+        # Average of the last window returns, None until window episodes have run
+        return self.moving_average() if len(self._window_values) == self.window else None
+
+    def curve(self):
+        # (episodes, moving averages) of the downsampled curve
+        return np.array(self._curve_episodes), np.array(self._curve_values)
@@ -0,0 +1,74 @@
+from checkpoint import latest_checkpoint
+from racetrack import Racetrack
+from rl_racetrack import RLRacetrack
+
+import numpy as np
+import pytest
+
+CONFIG = {'grid_shape': [30, 30], 'seed': 3, 'episodes': 300, 'epsilon': 0.1, 'delta': 0.1, 'timestep_reward': -1,
+          'update_state_values_rule': 'last_visit', 'max_speed_x': 5, 'max_speed_y': 0, 'min_speed_x': 0,
+          'min_speed_y': -5, 'max_episode_length': 500, 'log_level': 'off'}
+MODES = {'sequential': {}, 'batch': {'batch_size': 16}, 'actor': {'n_workers': 2, 'sync_interval': 25}}
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_run(tmp_path, **settings):
+    config = dict(CONFIG, **settings)
+    track = Racetrack(config)
+    track.create_grid(str(tmp_path))
+    return RLRacetrack(config, track)
+
+
+def interrupt_after(rl_racetrack, episodes):
+    # Kill the run at the first checkpoint opportunity after episodes
+    checkpoint_if_due = rl_racetrack.checkpoint_if_due
+
+    def interrupted():
+        checkpoint_if_due()
+        if rl_racetrack.episode >= episodes:
+            raise Interrupted
+    rl_racetrack.checkpoint_if_due = interrupted
+
+
+def assert_same_training(a, b):
+    assert np.array_equal(a.state_values.values, b.state_values.values)
+    assert np.array_equal(a.state_values.counts, b.state_values.counts)
+    assert a.stats.get_state() == b.stats.get_state()
+    assert (a.episode, a.total_steps) == (b.episode, b.total_steps)
+
+
+@pytest.mark.parametrize('mode', list(MODES))
+def test_resume_after_interruption(tmp_path, mode):
+    uninterrupted = make_run(tmp_path, **MODES[mode])
+    uninterrupted.run(str(tmp_path / 'uninterrupted.csv'))
+
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    killed = make_run(tmp_path, checkpoint_dir=checkpoint_dir, checkpoint_interval=100, **MODES[mode])
+    interrupt_after(killed, 250)
+    with pytest.raises(Interrupted):
+        killed.run(str(tmp_path / 'killed.csv'))
+
+    resumed = make_run(tmp_path, checkpoint_dir=checkpoint_dir, checkpoint_interval=100, **MODES[mode])
+    resumed.resume(checkpoint_dir)
+    assert 0 < resumed.episode < 250
+    resumed.run(str(tmp_path / 'resumed.csv'))
+    assert_same_training(uninterrupted, resumed)
+
+
+def test_resume_completed_run(tmp_path):
+    # The final checkpoint of a run resumed when already complete must not destroy the one it was loaded from
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    run = make_run(tmp_path, checkpoint_dir=checkpoint_dir, episodes=100)
+    run.run(str(tmp_path / 'run.csv'))
+    for _ in range(2):
+        resumed = make_run(tmp_path, checkpoint_dir=checkpoint_dir, episodes=100)
+        resumed.resume(checkpoint_dir)
+        resumed.run(str(tmp_path / 'resumed.csv'))
+        assert resumed.stop_reason == 'episodes'
+    assert latest_checkpoint(checkpoint_dir) is not None
+    resumed = make_run(tmp_path, checkpoint_dir=checkpoint_dir, episodes=100)
+    resumed.resume(checkpoint_dir)
+    assert_same_training(run, resumed)
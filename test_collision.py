@@ -0,0 +1,70 @@
+from bresenham import bresenham
+from racetrack import Racetrack
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='module')
+def racetrack(tmp_path_factory):
+    config = {'grid_shape': [40, 40], 'seed': 7, 'min_speed_x': 0, 'max_speed_x': 4, 'min_speed_y': -4,
+              'max_speed_y': 0}
+    track = Racetrack(config)
+    track.create_grid(str(tmp_path_factory.mktemp('tracks')))
+    return track
+
+
+def crosses_wall(grid, x0, y0, x1, y1):
+    # A cell of the bresenham line is a wall, cells outside the grid are ignored
+    height, width = grid.shape
+    return any(0 <= x < width and 0 <= y < height and grid[y, x] == 0 for x, y in bresenham(x0, y0, x1, y1))
+
+
+def expected_crash(grid, position, velocity):
+    x, y = position
+    height, width = grid.shape
+    if not (0 <= x < width and 0 <= y < height) or grid[y, x] == 0:
+        return True
+    return grid[y, x] != 1 and crosses_wall(grid, x - velocity[0], y - velocity[1], x, y)
+
+
+def random_moves(racetrack, n, max_speed, seed=0):
+    # Moves from random drivable positions, ending on or off the grid
+    rng = np.random.default_rng(seed)
+    ys, xs = np.nonzero(racetrack.grid != 0)
+    i = rng.integers(len(xs), size=n)
+    vx, vy = rng.integers(-max_speed, max_speed + 1, size=(2, n))
+    return xs[i], ys[i], vx, vy
+
+
+def test_swept(racetrack):
+    x0, y0, vx, vy = random_moves(racetrack, 5000, 8)
+    # Starts off the grid too
+    x0, y0 = x0 + vx // 2, y0 - vy // 2
+    crashed = racetrack.collision.swept(x0, y0, x0 + vx, y0 + vy)
+    assert crashed.tolist() == [crosses_wall(racetrack.grid, *move)
+                                for move in zip(x0.tolist(), y0.tolist(), (x0 + vx).tolist(), (y0 + vy).tolist())]
+
+
+def test_line_crosses_wall(racetrack):
+    x0, y0, vx, vy = random_moves(racetrack, 5000, 8, seed=1)
+    for move in zip(x0.tolist(), y0.tolist(), (x0 + vx).tolist(), (y0 + vy).tolist()):
+        assert racetrack.collision.line_crosses_wall(*move) == crosses_wall(racetrack.grid, *move), move
+
+
+@pytest.mark.parametrize('max_speed', [4, 8])
+def test_check_for_crash(racetrack, max_speed):
+    # Speed 4 stays in the state space (looked up), speed 8 is mostly out of it (rasterized)
+    x0, y0, vx, vy = random_moves(racetrack, 5000, max_speed, seed=max_speed)
+    for x, y, dx, dy in zip(x0.tolist(), y0.tolist(), vx.tolist(), vy.tolist()):
+        position, velocity = (x + dx, y + dy), (dx, dy)
+        expected = expected_crash(racetrack.grid, position, velocity)
+        assert racetrack.check_for_crash(position, velocity) == expected, (position, velocity)
+        assert racetrack.collision.crash(position, velocity) == expected, (position, velocity)
+
+
+def test_crashes(racetrack):
+    x0, y0, vx, vy = random_moves(racetrack, 5000, 6, seed=3)
+    crashed = racetrack.collision.crashes(x0, y0, vx, vy)
+    assert crashed.tolist() == [expected_crash(racetrack.grid, (x + dx, y + dy), (dx, dy))
+                                for x, y, dx, dy in zip(x0.tolist(), y0.tolist(), vx.tolist(), vy.tolist())]
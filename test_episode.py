@@ -0,0 +1,45 @@
+from episode import Episode
+from racetrack import Racetrack
+from rl_racetrack import RLRacetrack
+
+import numpy as np
+import pytest
+
+CONFIG = {'grid_shape': [30, 30], 'seed': 3, 'episodes': 200, 'epsilon': 0.1, 'delta': 0.1, 'timestep_reward': -1,
+          'update_state_values_rule': 'last_visit', 'max_speed_x': 5, 'max_speed_y': 0, 'min_speed_x': 0,
+          'min_speed_y': -5, 'max_episode_length': 300, 'log_level': 'off'}
+
+
+@pytest.fixture(scope='module')
+def trained(tmp_path_factory):
+    # Learnt state values, so that the simulations mix greedy, tied and exploratory actions
+    track = Racetrack(CONFIG)
+    track.create_grid(str(tmp_path_factory.mktemp('tracks')))
+    rl_racetrack = RLRacetrack(CONFIG, track)
+    rl_racetrack.run(str(tmp_path_factory.mktemp('logs') / 'log.csv'))
+    return rl_racetrack
+
+
+def make_episode(rl_racetrack, seed, random_start=True):
+    # Short episodes, so that some of them are truncated
+    return Episode(rl_racetrack.racetrack, rl_racetrack.epsilon, rl_racetrack.state_values,
+                   rl_racetrack.min_speed_x, rl_racetrack.max_speed_x, rl_racetrack.min_speed_y,
+                   rl_racetrack.max_speed_y, rl_racetrack.delta, 15,
+                   random_start=random_start, rng=np.random.default_rng(seed))
+
+
+@pytest.mark.parametrize('random_start', [True, False])
+def test_timed_simulation_is_identical(trained, random_start):
+    # The instrumented loop (see Episode._run_timed) simulates the same paths with the same random numbers
+    plain, timed = make_episode(trained, 5, random_start), make_episode(trained, 5, random_start)
+    timers = {'reset': 0.0, 'action_selection': 0.0, 'move_outcome': 0.0}
+    outcomes = set()
+    for _ in range(300):
+        path, reached_end = plain.simulate()
+        timed_path, timed_reached_end = timed.simulate(timers=timers)
+        assert np.array_equal(path, timed_path)
+        assert reached_end == timed_reached_end
+        assert plain.get_random_state() == timed.get_random_state()
+        outcomes.add(reached_end)
+    assert outcomes == {True, False}
+    assert all(seconds > 0 for seconds in timers.values())
@@ -0,0 +1,42 @@
+from episode_log import EpisodeLogReader, is_binary_log, open_episode_log
+
+import numpy as np
+import pytest
+
+
+def random_paths(rng, n):
+    # Paths as written by the simulators: rows (x, y, vx, vy, action index), -1 for the starts
+    paths = []
+    for _ in range(n):
+        path = rng.integers(-5, 120, size=(rng.integers(1, 40), 5)).astype(np.int32)
+        path[0, 4] = -1
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_binary_log_export_csv(tmp_path, background):
+    paths = random_paths(np.random.default_rng(0), 50)
+    episodes = list(range(3, 3 + 2 * len(paths), 2))
+    for log_format, filename in (('csv', 'direct.csv'), ('binary', 'log.bin')):
+        log = open_episode_log(str(tmp_path / filename), log_format, background=background)
+        for episode, path in zip(episodes, paths):
+            log.write_episode(episode, path)
+        log.close()
+
+    assert is_binary_log(tmp_path / 'log.bin')
+    reader = EpisodeLogReader(str(tmp_path / 'log.bin'))
+    assert len(reader) == len(paths)
+    assert reader.episode_numbers.tolist() == episodes
+    for i, path in enumerate(paths):
+        assert np.array_equal(reader.episode(i), path)
+
+    reader.export_csv(str(tmp_path / 'exported.csv'))
+    assert (tmp_path / 'exported.csv').read_bytes() == (tmp_path / 'direct.csv').read_bytes()
+
+
+def test_empty_binary_log(tmp_path):
+    log = open_episode_log(str(tmp_path / 'log.bin'), 'binary')
+    log.close()
+    reader = EpisodeLogReader(str(tmp_path / 'log.bin'))
+    assert len(reader) == 0
@@ -0,0 +1,61 @@
+from racetrack import Racetrack
+from rl_racetrack import RLRacetrack
+
+import numpy as np
+import pytest
+
+CONFIG = {'grid_shape': [30, 30], 'seed': 3, 'episodes': 200, 'epsilon': 0.1, 'delta': 0.1, 'timestep_reward': -1,
+          'max_speed_x': 5, 'max_speed_y': 0, 'min_speed_x': 0, 'min_speed_y': -5, 'max_episode_length': 500,
+          'log_level': 'off'}
+
+
+@pytest.fixture(scope='module')
+def racetrack(tmp_path_factory):
+    track = Racetrack(CONFIG)
+    track.create_grid(str(tmp_path_factory.mktemp('tracks')))
+    return track
+
+
+def full_refresh(state_values):
+    greedy = state_values.greedy.copy()
+    state_values.refresh_greedy()
+    return greedy, state_values.greedy
+
+
+@pytest.mark.parametrize('rule', ['first_visit', 'every_visit', 'last_visit', 'last_visit_best'])
+def test_incremental_refresh_after_training(racetrack, tmp_path, rule):
+    # The greedy actions refreshed after every update are those of a full refresh
+    rl_racetrack = RLRacetrack(dict(CONFIG, update_state_values_rule=rule), racetrack)
+    rl_racetrack.run(str(tmp_path / 'log.csv'))
+    incremental, full = full_refresh(rl_racetrack.state_values)
+    assert (full >= 0).any()
+    assert np.array_equal(incremental, full)
+
+
+def test_incremental_refresh_random_updates(racetrack):
+    rng = np.random.default_rng(0)
+    rl_racetrack = RLRacetrack(dict(CONFIG, update_state_values_rule='last_visit'), racetrack)
+    state_values = rl_racetrack.state_values
+    for _ in range(50):
+        # Few distinct values and counts, so that there are ties
+        changed = rng.choice(len(state_values), size=200, replace=False)
+        state_values.values[changed] = rng.integers(-5, 0, size=len(changed))
+        state_values.counts[changed] = rng.integers(0, 3, size=len(changed))
+        state_values.refresh_greedy(changed)
+    incremental, full = full_refresh(state_values)
+    assert np.array_equal(incremental, full)
+
+
+def test_greedy_actions(racetrack):
+    # A greedy action is a possible action leading to the best (value, count) move
+    rng = np.random.default_rng(1)
+    rl_racetrack = RLRacetrack(dict(CONFIG, update_state_values_rule='last_visit'), racetrack)
+    state_values = rl_racetrack.state_values
+    state_values.assign(rng.normal(size=len(state_values)), rng.integers(0, 5, size=len(state_values)))
+    n_velocities = racetrack.n_velocities
+    for s in rng.choice(len(state_values), size=500, replace=False).tolist():
+        p, v = divmod(s, n_velocities)
+        moves = {a: p * n_velocities + m for a, m in enumerate(racetrack.action_moves[v].tolist()) if m >= 0}
+        keys = {a: (state_values.values[m], state_values.counts[m]) for a, m in moves.items()}
+        best = [a for a, key in keys.items() if key == max(keys.values())]
+        assert state_values.greedy[s] == (best[0] if len(best) == 1 else -1)
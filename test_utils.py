@@ -0,0 +1,45 @@
+from utils import closed_segment_intersect, closed_segment_intersect_batch, crosses_vertical_segment
+
+import numpy as np
+import pytest
+
+
+def random_segments(rng, n, low=-6, high=6):
+    return rng.integers(low, high + 1, size=(n, 4, 2))
+
+
+def vertical_segments(rng, n):
+    # Random segments a, b against vertical segments c, d, with many degenerate and collinear ones
+    points = random_segments(rng, n, -4, 4)
+    points[:, 3, 0] = points[:, 2, 0]
+    points[::3, 0, 0] = points[::3, 2, 0]  # a on the line of c, d
+    points[::6, 1] = points[::6, 0]  # a == b
+    points[::5, 3, 1] = points[::5, 2, 1]  # c == d
+    points[::4, 1, 0] = points[::4, 0, 0]  # a, b vertical
+    return points
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_crosses_vertical_segment(seed):
+    for a, b, c, d in vertical_segments(np.random.default_rng(seed), 20000).tolist():
+        low, high = min(c[1], d[1]), max(c[1], d[1])
+        expected = closed_segment_intersect(tuple(a), tuple(b), (c[0], low), (c[0], high))
+        assert crosses_vertical_segment(*a, *b, c[0], low, high) == expected, (a, b, c, d)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_closed_segment_intersect_batch(seed):
+    rng = np.random.default_rng(seed)
+    for points in (random_segments(rng, 20000), random_segments(rng, 20000, -2, 2), vertical_segments(rng, 20000)):
+        batch = closed_segment_intersect_batch(points[:, 0], points[:, 1], points[:, 2], points[:, 3])
+        expected = [closed_segment_intersect(*map(tuple, segments)) for segments in points.tolist()]
+        assert batch.tolist() == expected
+
+
+def test_degenerate_segments():
+    # A point only intersects a segment at its endpoints
+    assert crosses_vertical_segment(0, 1, 0, 1, 0, 0, 2) == closed_segment_intersect((0, 1), (0, 1), (0, 0), (0, 2))
+    assert crosses_vertical_segment(0, 0, 0, 2, 0, 1, 1) == closed_segment_intersect((0, 0), (0, 2), (0, 1), (0, 1))
+    assert crosses_vertical_segment(0, 0, 0, 0, 0, 0, 2)
+    assert crosses_vertical_segment(-1, 3, 1, 3, 0, 0, 3)
+    assert not crosses_vertical_segment(-1, 4, 1, 4, 0, 0, 3)
@@ -0,0 +1,83 @@
+from checkpoint import latest_checkpoint
+from episode_log import log_filename
+from racetrack import Racetrack
+from report import start_report
+from rl_racetrack import RLRacetrack
+from utils import timestamp
+
+import argparse
+import json
+import os
+import yaml
+
+
+def parse_overrides(overrides):
+    # key=value pairs, the values are parsed as YAML (numbers, booleans, lists...)
+    config = {}
+    for override in overrides:
+        key, sep, value = override.partition('=')
+        if not sep:
+            raise ValueError(f'Invalid override {override}, expected key=value')
+        config[key] = yaml.safe_load(value)
+    return config
+
+
+def train(config, run_dir, resume=False):
+    # Train without any plotting nor display and save the artifacts of the run in run_dir:
+    # config.yaml, the track (grid_<hash>.npz, see Racetrack.create_grid), the episode log, the final checkpoint
+    # (in checkpoint_dir, run_dir/checkpoint by default, see RLRacetrack.resume) and summary.json (see
+    # RLRacetrack.summary). With resume, an interrupted run continues from its last checkpoint (if any) and logs
+    # the remaining episodes to episodes_from_<episode>
+    os.makedirs(run_dir, exist_ok=True)
+    config = dict(config)
+    config.setdefault('checkpoint_dir', os.path.join(run_dir, 'checkpoint'))
+    with open(os.path.join(run_dir, 'config.yaml'), 'w') as f:
+        yaml.safe_dump(config, f)
+
+    track = Racetrack(config)
+    grid_file = track.create_grid()
+    track.store_grid(os.path.join(run_dir, grid_file))
+
+    rl_racetrack = RLRacetrack(config, track)
+    log_name = 'episodes'
+    if resume:
+        if latest_checkpoint(config['checkpoint_dir']) is None:
+            print(f'No checkpoint in {config["checkpoint_dir"]}, starting over')
+        else:
+            rl_racetrack.resume(config['checkpoint_dir'])
+            print(f'Resuming after episode {rl_racetrack.episode}')
+            log_name = f'episodes_from_{rl_racetrack.episode}'
+    rl_racetrack.run(os.path.join(run_dir, log_filename(log_name, config.get('log_format', 'csv'))))
+    rl_racetrack.print_stats()
+
+    with open(os.path.join(run_dir, 'summary.json'), 'w') as f:
+        json.dump(rl_racetrack.summary(), f, indent=2)
+    return rl_racetrack
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train on a racetrack without plots nor display')
+    parser.add_argument('config', nargs='?', default='config.yaml', help='configuration file')
+    parser.add_argument('overrides', nargs='*', help='configuration overrides as key=value')
+    parser.add_argument('--run-dir', help='directory of the run artifacts, runs/run_<timestamp> by default')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the interrupted run of --run-dir from its last checkpoint, with its config.yaml '
+                             '(the config argument is ignored, the overrides apply)')
+    parser.add_argument('--report', action='store_true',
+                        help='render the report figures in a separate process (see report.py), without waiting')
+    args = parser.parse_args()
+
+    overrides = args.overrides
+    if args.resume:
+        if args.run_dir is None:
+            parser.error('--resume needs the --run-dir of the run')
+        if '=' in args.config:
+            # No configuration file: the first positional argument is an override
+            overrides = [args.config] + overrides
+    with open(os.path.join(args.run_dir, 'config.yaml') if args.resume else args.config) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config.update(parse_overrides(overrides))
+    run_dir = args.run_dir or os.path.join('runs', f'run_{timestamp()}')
+    train(config, run_dir, resume=args.resume)
+    if args.report:
+        start_report([run_dir])
@@ -1,6 +1,22 @@
+import datetime
 import numpy as np
 
 
+def timestamp():
+    # Current time as used in the names of the run files, e.g. 2023_02_22h21_32_50
+    return datetime.datetime.now().strftime('%Y_%m_%dh%H_%M_%S')
+
+
+def show_or_save(filename=None):
+    # Show the current matplotlib figure, or save it to filename and close it (does not block)
+    import matplotlib.pyplot as plt
+    if filename is None:
+        plt.show()
+    else:
+        plt.savefig(filename, bbox_inches='tight')
+        plt.close()
+
+
 def side(a, b, c):
     """ Returns a position of the point c relative to the line going through a and b
         Points a, b are expected to be different
@@ -56,8 +72,64 @@ def closed_segment_intersect(a, b, c, d):
     return True
 
 
-def mov_avg(x, window):
-    # Convert to numpy array
-    x = np.array(x)
-    ans = np.convolve(x, np.ones(window) / window, mode='valid')
-    return np.concatenate((np.mean(x[:window - 1]) * np.ones(window - 1), ans)).tolist()
+def crosses_vertical_segment(x0, y0, x1, y1, x, low, high):
+    """ Same as closed_segment_intersect((x0, y0), (x1, y1), (x, low), (x, high)) for integers with low <= high,
+        e.g. the finish line: the segment is given by its precomputed x and y range, nothing is built per call.
+    """
+    if x0 < x:
+        if x1 < x:
+            return False
+    elif x0 > x:
+        if x1 > x:
+            return False
+    if low == high:
+        return (x0 == x and y0 == low) or (x1 == x and y1 == low)
+    if x0 == x1:
+        # On the same line
+        if y0 == y1:
+            return y0 == low or y0 == high
+        return (y0 <= high and y1 >= low) if y0 < y1 else (y1 <= high and y0 >= low)
+    # y of the segment at x is num / den, compared without rounding
+    den = x1 - x0
+    num = y0 * den + (x - x0) * (y1 - y0)
+    if den < 0:
+        return high * den <= num <= low * den
+    return low * den <= num <= high * den
+
+
+def side_batch(a, b, c):
+    """ Vectorized side: arrays of points with the coordinates on the last axis
+    """
+    d = (c[..., 1] - a[..., 1]) * (b[..., 0] - a[..., 0]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0])
+    return np.sign(d)
+
+
+def is_point_in_closed_segment_batch(a, b, c):
+    """ Vectorized is_point_in_closed_segment
+    """
+    return np.where(a[..., 0] < b[..., 0], (a[..., 0] <= c[..., 0]) & (c[..., 0] <= b[..., 0]),
+           np.where(b[..., 0] < a[..., 0], (b[..., 0] <= c[..., 0]) & (c[..., 0] <= a[..., 0]),
+           np.where(a[..., 1] < b[..., 1], (a[..., 1] <= c[..., 1]) & (c[..., 1] <= b[..., 1]),
+           np.where(b[..., 1] < a[..., 1], (b[..., 1] <= c[..., 1]) & (c[..., 1] <= a[..., 1]),
+                    (a == c).all(axis=-1)))))
+
+
+def closed_segment_intersect_batch(a, b, c, d):
+    """ Vectorized closed_segment_intersect: a, b, c, d are arrays of points of shape (..., 2), broadcast
+        against each other. Returns the boolean mask of the intersecting segments.
+    """
+    a, b, c, d = np.broadcast_arrays(*(np.asarray(p) for p in (a, b, c, d)))
+    s1 = side_batch(a, b, c)
+    s2 = side_batch(a, b, d)
+    collinear = (s1 == 0) & (s2 == 0)
+    on_segment = is_point_in_closed_segment_batch(a, b, c) | is_point_in_closed_segment_batch(a, b, d) | \
+        is_point_in_closed_segment_batch(c, d, a) | is_point_in_closed_segment_batch(c, d, b)
+    t1 = side_batch(c, d, a)
+    t2 = side_batch(c, d, b)
+    crossing = ~((s1 != 0) & (s1 == s2)) & ~((t1 != 0) & (t1 == t2))
+
+    intersect = np.where(collinear, on_segment, crossing)
+    a_is_b = (a == b).all(axis=-1)
+    c_is_d = (c == d).all(axis=-1)
+    intersect = np.where(c_is_d, (c == a).all(axis=-1) | (c == b).all(axis=-1), intersect)
+    return np.where(a_is_b, (a == c).all(axis=-1) | (a == d).all(axis=-1), intersect)
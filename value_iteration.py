@@ -0,0 +1,130 @@
+from episode import ACTIONS
+from racetrack import Racetrack, CRASH, FINISHED
+from state_values import StateValues
+
+import numpy as np
+
+
+class ValueIteration:
+    def __init__(self, racetrack: Racetrack, timestep_reward, delta):
+        # Exact solver of the racetrack MDP simulated by Episode: same states, actions (Racetrack.action_moves),
+        # no-op probability delta, crash resets to a random start state and reward timestep_reward per path entry.
+        # Values are expected returns to the end of the episode, as estimated by the 'last_visit' Monte Carlo rule
+        # (every entry of the path counts, including crashed ones); max_episode_length is ignored. 'first_visit'
+        # and 'every_visit' estimate the return from the start of the episode instead, 'last_visit_best' the best
+        # observed return: their values are not comparable.
+        #   values[s]: value of the state s = (position, velocity)
+        #   move_values[m]: value of the path entries after moving from position with velocity, m = (position,
+        #     velocity) indexed like the states (see Racetrack.transitions). Episode's greedy choice reads its value
+        #     table at (position, velocity + action), so move_values is the table that makes it follow the optimal
+        #     policy, see state_values
+        self.racetrack = racetrack
+        self.timestep_reward = timestep_reward
+        self.delta = delta
+
+        n_states = racetrack.n_states
+        vel_x, vel_y = racetrack.velocity_components()
+        p, v = np.divmod(np.arange(n_states), racetrack.n_velocities)
+        x, y = racetrack.positions[p, 0], racetrack.positions[p, 1]
+        vx, vy = vel_x[v], vel_y[v]
+
+        # Moves: where the car lands when it does not crash nor finish
+        self.outcomes = racetrack.transitions
+        self.next_states = racetrack.state_indices(x + vx, y + vy, vx, vy)
+
+        # Actions: the velocity index of the move at the state's position (see Racetrack.action_moves), n_velocities
+        # when not possible (an entry past the last velocity of the position holding -inf, see action_values)
+        self.state_positions, self.state_velocities = p, v
+        self.action_moves = np.where(racetrack.action_moves >= 0, racetrack.action_moves, racetrack.n_velocities)
+
+        # Start states, see Episode.simulate
+        start = np.array([(x, y) for y, x in racetrack.start_positions])
+        start_vy = np.arange(racetrack.min_speed_y, racetrack.max_speed_y + 1)
+        self.start_states = racetrack.state_indices(np.repeat(start[:, 0], len(start_vy)),
+                                                    np.repeat(start[:, 1], len(start_vy)),
+                                                    np.zeros(len(start) * len(start_vy), dtype=np.int64),
+                                                    np.tile(start_vy, len(start)))
+        self.start_states = self.start_states[self.start_states >= 0]
+
+        self.values = np.zeros(n_states)
+        self.move_values = np.zeros(n_states)
+        self.restart_value = 0.0
+        self.policy = np.full(n_states, ACTIONS.index((0, 0)))
+        self.iterations = 0
+
+    def compute_move_values(self, values, restart_value):
+        # Value of the path entries after each move, a crash leading to a start state worth restart_value
+        r = self.timestep_reward
+        continuing = values[np.maximum(self.next_states, 0)]
+        return np.where(self.outcomes == FINISHED, r, np.where(self.outcomes == CRASH, r + restart_value, continuing))
+
+    def by_position(self, move_values, fill):
+        # (position, velocity index) table of move_values, with a last column of fill for the impossible actions
+        by_position = move_values.reshape(-1, self.racetrack.n_velocities)
+        return np.concatenate((by_position, np.full((len(by_position), 1), fill)), axis=1)
+
+    def action_values(self, move_values):
+        # Expected value of the entries after each action: the action is replaced by a no-op with probability delta
+        chosen = self.by_position(move_values, -np.inf)[:, self.action_moves].reshape(len(move_values), -1)
+        return (1 - self.delta) * chosen + self.delta * move_values[:, None]
+
+    def solve_restart_value(self, restart_value, tolerance, max_iterations):
+        # Value iteration with the value of restarting after a crash held fixed, so that crashes end the episode
+        # and values converge in about as many iterations as the longest path. Alongside, the probability of
+        # crashing under the greedy policy, the derivative of the values with respect to restart_value
+        values, crash_probability = self.values, np.zeros(self.racetrack.n_states)
+        crashes, finished = self.outcomes == CRASH, self.outcomes == FINISHED
+        next_states = np.maximum(self.next_states, 0)
+        rows = np.arange(self.racetrack.n_states)
+        for _ in range(max_iterations):
+            self.iterations += 1
+            action_values = self.action_values(self.compute_move_values(values, restart_value))
+            best = action_values.argmax(axis=1)
+            new_values = self.timestep_reward + action_values[rows, best]
+
+            move_probability = np.where(finished, 0, np.where(crashes, 1, crash_probability[next_states]))
+            chosen = self.by_position(move_probability, 0)[self.state_positions,
+                                                           self.action_moves[self.state_velocities, best]]
+            crash_probability = (1 - self.delta) * chosen + self.delta * move_probability
+
+            change = np.max(np.abs(new_values - values))
+            values = new_values
+            if change < tolerance:
+                break
+        return values, crash_probability
+
+    def solve(self, tolerance=1e-6, max_iterations=100000):
+        # Policy iteration on the value of restarting after a crash: the start states are worth a + p * R when
+        # crashes are worth restarting at R, with p the probability of crashing, so the greedy policy for R is
+        # worth R = a / (1 - p). Each step improves the policy, a few steps are enough
+        self.iterations = 0
+        while self.iterations < max_iterations:
+            self.values, crash_probability = self.solve_restart_value(self.restart_value, tolerance,
+                                                                      max_iterations - self.iterations)
+            start_value = self.values[self.start_states].mean()
+            p = crash_probability[self.start_states].mean()
+            restart_value = (start_value - p * self.restart_value) / (1 - p) if p < 1 else start_value
+            change = abs(restart_value - self.restart_value)
+            self.restart_value = restart_value
+            if change < tolerance:
+                break
+        self.move_values = self.compute_move_values(self.values, self.restart_value)
+        self.policy = self.action_values(self.move_values).argmax(axis=1)
+        return self.values
+
+    def state_values(self):
+        # StateValues that make Episode's greedy choice follow the optimal policy, e.g. for
+        # RLRacetrack.learnt_policy_path
+        state_values = StateValues(self.racetrack, 0)
+        state_values.assign(self.move_values.copy(), np.zeros(self.racetrack.n_states, dtype=np.int64))
+        return state_values
+
+    def value_error(self, state_values: StateValues, update_state_values_rule='last_visit'):
+        # Root mean squared error of Monte Carlo estimates against the optimal values, over the visited states.
+        # Only the estimates of the 'last_visit' rule are expected returns to the end of the episode
+        if update_state_values_rule != 'last_visit':
+            raise ValueError(f'The values of the {update_state_values_rule} rule are not expected returns to the end '
+                             f'of the episode, only the last_visit ones can be compared to the optimal values')
+        visited = state_values.counts > 0
+        return np.sqrt(np.mean((state_values.values[visited] - self.values[visited]) ** 2)) if visited.any() \
+            else np.nan
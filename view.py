@@ -1,45 +1,96 @@
+from episode_log import EpisodeLogReader, is_binary_log
 from racetrack import Racetrack
+from collections import OrderedDict
+import numpy as np
+import os
 import random
 import pygame
 
+# Colors of the grid values: 0 = outside, 1 = start, 2 = inside, 3 = finish
+TRACK_COLORS = np.array([pygame.Color(c)[:3] for c in ['black', '#7bc043', '#f4f4f8', '#fe4a49']], dtype=np.uint8)
+
 class View:
-    def __init__(self):
+    def __init__(self, cache_size=64):
         self.map = None
         self.height = 800
         self.width = self.height*0.8
         self.map_height = None
         self.episodes = None
-        self.n_episodes = []
         self.file_path = None
+        self.log_reader = None
+        # Text logs: byte offset of every 'Episode' line, plus the file size
+        self.episode_offsets = np.zeros(1, dtype=np.int64)
+        # Number of every episode of the log, the log may only keep some of the episodes of the run
+        self.episode_numbers = np.zeros(0, dtype=np.int64)
+        # Parsed episodes, least recently used first
+        self.cache_size = cache_size
+        self.episode_cache = OrderedDict()
+        # Track rendered once at the size of the map surface, see track_surface
+        self._track_surface = None
+        # Number of segments of the current episode already drawn on the map surface
+        self.drawn_frames = 0
 
     def load_path(self, file_path):
+        # Index the episodes of the log, they are parsed when drawn
         self.file_path = file_path
-        with open(file_path, 'r') as f:
-            self.n_episodes = []
-            lines = f.readlines()
-            count = 0
-            for line in lines:
-                if line[0] == 'E': # New episode
-                    self.n_episodes.append(count)
-                count += 1
-            self.n_episodes.append(len(lines))
-
+        self.episode_cache.clear()
+        if is_binary_log(file_path):
+            self.log_reader = EpisodeLogReader(file_path)
+            self.episode_numbers = np.array(self.log_reader.episode_numbers)
+            return
+        self.log_reader = None
+        offsets = []
+        numbers = []
+        with open(file_path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line[:1] == b'E':  # New episode: 'Episode N'
+                    offsets.append(offset)
+                    numbers.append(int(line.split()[1].rstrip(b':')))
+                offset += len(line)
+            offsets.append(offset)
+        self.episode_offsets = np.array(offsets, dtype=np.int64)
+        self.episode_numbers = np.array(numbers, dtype=np.int64)
+
+    def episode_count(self):
+        if self.log_reader is not None:
+            return len(self.log_reader)
+        return len(self.episode_offsets) - 1
+
+    def get_episode(self, ep):
+        # (x, y, vx, vy) rows of an episode, parsed once and kept in a bounded LRU cache
+        if ep in self.episode_cache:
+            self.episode_cache.move_to_end(ep)
+            return self.episode_cache[ep]
+
+        if self.log_reader is not None:
+            path = np.array(self.log_reader.episode(ep)[:, :4], dtype=np.int64)
+        else:
+            with open(self.file_path, 'rb') as f:
+                f.seek(self.episode_offsets[ep])
+                lines = f.read(self.episode_offsets[ep + 1] - self.episode_offsets[ep])
+            steps = lines.split(b'\n', 1)[1] if b'\n' in lines else b''
+            path = np.array(steps.replace(b',', b' ').split(), dtype=np.int64).reshape(-1, 4)
+
+        self.episode_cache[ep] = path
+        if len(self.episode_cache) > self.cache_size:
+            self.episode_cache.popitem(last=False)
+        return path
 
     def load_map(self, path):
-        # parse map
+        # track cache file (see Racetrack.store_grid) or csv grid
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                self.set_map(data['grid'])
+            return
         with open(path, 'r') as f:
-            map = []
-            lines = f.readlines()
-            for line in lines:
-                row = line.split(',')
-                try:
-                    row.remove('\n')
-                except:
-                    pass
-                row = [int(x) for x in row]
-                map.append(row)
-            self.map_height = len(map[0])
-            self.map = map
+            self.set_map(np.array([line.rstrip().rstrip(',').split(',') for line in f], dtype=np.uint8))
+
+    def set_map(self, grid):
+        # uint8 grid array, as Racetrack.grid
+        self.map = np.asarray(grid, dtype=np.uint8)
+        self.map_height = self.map.shape[1]
+        self._track_surface = None
 
     def set_path(self, path):
         self.path = path
@@ -70,63 +121,93 @@ class View:
         map_surf.fill('black')
         return map_surf
 
-    def draw_path(self, map_surf, path, n_frames):
-        for i in range(n_frames):
-            pygame.draw.line(map_surf, '#03396c', (path[i][0][0]*self.width*3/4/self.map_height, path[i][0][1]*self.width*3/4/self.map_height), (path[i+1][0][0]*self.width*3/4/self.map_height, path[i+1][0][1]*self.width*3/4/self.map_height), 3)
-            pygame.draw.circle(map_surf, '#03396c', (path[i][0][0]*self.width*3/4/self.map_height, path[i][0][1]*self.width*3/4/self.map_height), 4)
+    def draw_path(self, map_surf, path, n_frames, first_frame=0):
+        scale = self.width*3/4/self.map_height
+        for i in range(first_frame, n_frames):
+            pygame.draw.line(map_surf, '#03396c', (path[i][0]*scale, path[i][1]*scale), (path[i+1][0]*scale, path[i+1][1]*scale), 3)
+            pygame.draw.circle(map_surf, '#03396c', (path[i][0]*scale, path[i][1]*scale), 4)
 
     def update_info(self, episode):
+        # episode: index in the log, the number of the episode in the run is shown
         info_font = pygame.font.Font(None, 20)
-        text = 'Episode: ' + str(episode)
+        text = 'Episode: ' + str(self.episode_numbers[episode])
         info_surf = info_font.render(text, True, 'Black')
         return info_surf
 
     def draw_episodes(self, map_surf, ep, lim):
-        path = []
-        with open(self.file_path, 'r') as f:
-            lines = f.readlines()
-            for line in lines[self.n_episodes[ep]:self.n_episodes[ep+1]]:
-                if line[0] == 'E':
-                    continue
-                else:
-                    row = line.split(',')
-                    try:
-                        row.remove('\n')
-                    except:
-                        pass
-                    row = [int(x) for x in row]
-                    path.append([(row[0], row[1]), (row[2], row[3])])
+        # Only the segments not drawn yet are drawn, reset_map starts a new episode
+        path = self.get_episode(ep).tolist()
 
         n_frame = min(len(path)-1, lim)
 
-        self.draw_path(map_surf, path, n_frame)
-        return self.n_episodes[ep+1] - self.n_episodes[ep]
+        self.draw_path(map_surf, path, n_frame, self.drawn_frames)
+        self.drawn_frames = max(self.drawn_frames, n_frame)
+        # Number of frames of the episode, including the one of the 'Episode' line
+        return len(path) + 1
 
 
-    def draw_grid(self, map_surf):
-        for i in range(len(self.map)):
-            for j in range(len(self.map)):
-                if self.map[i][j] == 0:
-                    color = 'black'
-                elif self.map[i][j] == 1:
-                    color = '#7bc043'
-                elif self.map[i][j] == 2:
-                    color = '#f4f4f8'
-                elif self.map[i][j] == 3:
-                    color = '#fe4a49'
-                else:
-                    raise ValueError('Unknown value in map')
+    def track_surface(self, size):
+        # The track with its grid lines, rendered from the map array and only re-scaled when the size changes
+        if self._track_surface is None or self._track_surface.get_size() != (size, size):
+            cells = pygame.surfarray.make_surface(TRACK_COLORS[self.map].transpose(1, 0, 2))
+            n_rows, n_cols = self.map.shape
+            scale = size / self.map_height
+            track = pygame.transform.scale(cells, (round(n_cols * scale), round(n_rows * scale)))
+            surface = pygame.Surface((size, size))
+            surface.fill('black')
+            surface.blit(track, (0, 0))
 
-                pygame.draw.rect(map_surf, color, (j*self.width*3/4/self.map_height, i*self.width*3/4/self.map_height, self.width*3/4/self.map_height, self.width*3/4/self.map_height))
+            for i in range(len(self.map)):
+                vertical = (1 + i) * size / len(self.map)
+                pygame.draw.line(surface, 'black', (vertical, 0), (vertical, size), 1)
 
-        for i in range(len(self.map)):
-            vertical = (1 + i) * self.width * 3 / 4 / len(self.map)
-            pygame.draw.line(map_surf, 'black', (vertical, 0), (vertical, self.width * 3 / 4), 1)
+                horizontal = (1 + i) * size / len(self.map)
+                pygame.draw.line(surface, 'black', (0, horizontal), (size, horizontal), 1)
+            self._track_surface = surface
+        return self._track_surface
 
-            horizontal = (1 + i) * self.width * 3 / 4 / len(self.map)
-            pygame.draw.line(map_surf, 'black', (0, horizontal), (self.width * 3 / 4, horizontal), 1)
+    def draw_grid(self, map_surf):
+        map_surf.blit(self.track_surface(map_surf.get_width()), (0, 0))
 
+    def reset_map(self, map_surf):
+        # Clear the path drawn on the map surface
+        self.draw_grid(map_surf)
+        self.drawn_frames = 0
+
+    def sampled_episodes(self, n_episodes_to_show):
+        # Episodes shown by show: the first one and n_episodes_to_show more spread among all the episodes
+        step = int(self.episode_count()/n_episodes_to_show) if n_episodes_to_show else 0
+        return sorted({min(i * step, self.episode_count()-1) for i in range(n_episodes_to_show + 1)})
+
+    def render_frame(self, frame_surf, back_surf, map_surf, title, info_surf):
+        frame_surf.blit(back_surf, (0, 0))  # Add surface
+        frame_surf.blit(map_surf, (self.height/25, self.width/8))  # Add surface
+        frame_surf.blit(title, (self.height/25, self.width/25))  # Add font
+        frame_surf.blit(info_surf, (self.height/1.5, self.width/5))  # Add surface
+
+    def export_frames(self, episodes, out_dir, final_only=False):
+        # Headless rendering with SDL's dummy video driver: saves one image per frame of the given episodes,
+        # or only their last frame. Returns the image files
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        pygame.init()
+        os.makedirs(out_dir, exist_ok=True)
+        frame_surf = pygame.Surface((self.height, self.width))
+        back_surf = self.create_background()
+        map_surf = self.map_background()
+        title = self.create_title()
 
+        files = []
+        for ep in episodes:
+            self.reset_map(map_surf)
+            info_surf = self.update_info(ep)
+            n_steps = len(self.get_episode(ep))
+            for step in ([n_steps-1] if final_only else range(n_steps)):
+                self.draw_episodes(map_surf, ep, step)
+                self.render_frame(frame_surf, back_surf, map_surf, title, info_surf)
+                files.append(os.path.join(out_dir, f'episode_{self.episode_numbers[ep]:06d}_{step:05d}.png'))
+                pygame.image.save(frame_surf, files[-1])
+        pygame.quit()
+        return files
 
     def show(self, n_episodes_to_show = 10, speed = 1):
         pygame.init()
@@ -140,33 +221,34 @@ class View:
         map_surf = self.map_background()
         title = self.create_title()
         info_surf = self.create_info_surface()
-        self.draw_grid(map_surf)
+        self.reset_map(map_surf)
 
         run = 1
         step = 0
 
-        print('Episode: ', ep)
+        print('Episode: ', self.episode_numbers[ep])
         while run:
 
             for event in pygame.event.get():  # get all event
                 if event.type == pygame.QUIT:  # Check for exit
                     run = 0  # Exit
+                elif event.type == pygame.VIDEORESIZE:  # Re-scale the track, redraw the episode so far
+                    self.height, self.width = event.w, event.h
+                    back_surf = self.create_background()
+                    map_surf = self.map_background()
+                    self.reset_map(map_surf)
 
-            #map_surf = self.map_background()
-            screen.blit(back_surf, (0, 0))  # Add surface
-            screen.blit(map_surf, (self.height/25, self.width/8))  # Add surface
-            screen.blit(title, (self.height/25, self.width/25))  # Add font
-            screen.blit(info_surf, (self.height/1.5, self.width/5))  # Add surface
+            self.render_frame(screen, back_surf, map_surf, title, info_surf)
 
             if n_ep_show != 0 and step >= ep_length:
-                ep += int((len(self.n_episodes)-1)/n_episodes_to_show)
-                if ep == len(self.n_episodes)-1:
-                    ep = len(self.n_episodes)-2
+                ep += int(self.episode_count()/n_episodes_to_show)
+                if ep == self.episode_count():
+                    ep = self.episode_count()-1
                 step = 0
                 n_ep_show -= 1
-                print('Episode: ', ep)
+                self.reset_map(map_surf)
+                print('Episode: ', self.episode_numbers[ep])
 
-            self.draw_grid(map_surf)
             ep_length = self.draw_episodes(map_surf, ep, step)
             info_surf = self.update_info(ep)
 